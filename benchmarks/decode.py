@@ -0,0 +1,136 @@
+"""Compare reduced resolution and full resolution image decoding"""
+
+# Imports --------------------------------------------------------------------
+
+import argparse
+import glob
+import os
+import time
+import numpy as np
+
+from dotenv import load_dotenv
+from torchvision.io import ImageReadMode
+from torchvision.io import read_image
+
+from skyfilter.models import MODEL_PATH
+from skyfilter.models import get_predict_transform
+from skyfilter.models import load_predictor
+from skyfilter.models import predict_image_scores
+from skyfilter.models import read_image_draft
+
+# Setup ----------------------------------------------------------------------
+
+# Load environment variables
+load_dotenv()
+
+# Find images ----------------------------------------------------------------
+
+def find_images(images_dir: str, sample_size: int) -> list:
+    image_paths = sorted(
+        path for path in glob.glob(
+            os.path.join(images_dir, "**", "*"), recursive=True)
+        if os.path.isfile(path) and not path.endswith(".gitignore"))
+    return image_paths[:sample_size]
+
+# Time decoding --------------------------------------------------------------
+
+def time_decoding(image_paths: list, draft: bool) -> dict:
+
+    transform = get_predict_transform()
+    decode_times = []
+    transform_times = []
+    decoded_bytes = []
+
+    for image_path in image_paths:
+
+        start = time.perf_counter()
+        if draft:
+            image = read_image_draft(image_path)
+        else:
+            image = read_image(image_path, ImageReadMode.RGB).float()
+        decoded = time.perf_counter()
+        transform(image)
+        transformed = time.perf_counter()
+
+        decode_times.append(decoded - start)
+        transform_times.append(transformed - decoded)
+        decoded_bytes.append(image.numel() * image.element_size())
+
+    return {
+        "decode_ms": 1000 * np.mean(decode_times),
+        "transform_ms": 1000 * np.mean(transform_times),
+        "total_ms": 1000 * np.mean(
+            np.add(decode_times, transform_times)),
+        "mean_decoded_mb": np.mean(decoded_bytes) / 2 ** 20,
+        "max_decoded_mb": np.max(decoded_bytes) / 2 ** 20,
+    }
+
+# Compare scores -------------------------------------------------------------
+
+def compare_scores(
+        image_paths: list,
+        model_path: str,
+        batch_size: int = 16) -> dict:
+
+    predictor = load_predictor(model_path)
+    full_scores = []
+    draft_scores = []
+
+    for i in range(0, len(image_paths), batch_size):
+        batch = image_paths[i:i + batch_size]
+        full_scores += predict_image_scores(predictor, batch, draft=False)
+        draft_scores += predict_image_scores(predictor, batch, draft=True)
+
+    abs_diff = np.abs(np.array(draft_scores) - np.array(full_scores))
+
+    return {
+        "mean_abs_diff": float(np.mean(abs_diff)),
+        "p95_abs_diff": float(np.percentile(abs_diff, 95)),
+        "max_abs_diff": float(np.max(abs_diff)),
+    }
+
+# Print results --------------------------------------------------------------
+
+def print_results(title: str, results: dict) -> None:
+    print(title)
+    for key, value in results.items():
+        print(f"  {key}: {value:.4f}")
+
+# Main -----------------------------------------------------------------------
+
+def main(images_dir: str, sample_size: int, model_path: str | None) -> None:
+
+    image_paths = find_images(images_dir, sample_size)
+    print(f"Benchmarking {len(image_paths)} images from {images_dir}")
+
+    print_results(
+        "Full resolution decoding",
+        time_decoding(image_paths, draft=False))
+    print_results(
+        "Reduced resolution decoding",
+        time_decoding(image_paths, draft=True))
+
+    if model_path is not None:
+        print_results(
+            "Score parity",
+            compare_scores(image_paths, model_path))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--images-dir",
+        default=os.getenv("SF_DB_IMAGES_DIR"))
+    parser.add_argument("--sample-size", type=int, default=200)
+    parser.add_argument(
+        "--model-path",
+        default=MODEL_PATH,
+        help="model used for the score parity check")
+    parser.add_argument(
+        "--no-scores",
+        action="store_true",
+        help="skip the score parity check")
+    args = parser.parse_args()
+    main(
+        args.images_dir,
+        args.sample_size,
+        None if args.no_scores else args.model_path)
@@ -0,0 +1,191 @@
+"""Load test the feed index in memory and the feed server over HTTP"""
+
+# Imports --------------------------------------------------------------------
+
+import argparse
+import asyncio
+import json
+import time
+import numpy as np
+
+from datetime import timedelta
+from urllib.parse import quote
+from urllib.parse import urlsplit
+
+from skyfilter.feed import FEED_SKELETON_PATH
+from skyfilter.feed import FeedIndex
+from skyfilter.utils import utc_now
+
+# Create index ---------------------------------------------------------------
+
+def create_index(size: int, seed: int = 0) -> FeedIndex:
+    rng = np.random.default_rng(seed)
+    now = utc_now()
+    feed_index = FeedIndex(timedelta(hours=48))
+    for post_id in range(size):
+        feed_index.upsert(
+            post_id,
+            f"at://did:plc:benchmark/app.bsky.feed.post/{post_id}",
+            float(rng.random()),
+            now - timedelta(seconds=float(rng.random() * 172800)))
+    return feed_index
+
+# Time index -----------------------------------------------------------------
+
+def time_index(
+        feed_index: FeedIndex,
+        pages: int,
+        limit: int,
+        seed: int = 0) -> dict:
+
+    rng = np.random.default_rng(seed)
+
+    # Time reading pages by following cursors from the top of the feed
+    page_times = []
+    cursor = None
+    for _ in range(pages):
+        start = time.perf_counter()
+        _, cursor = feed_index.get_page(limit, cursor)
+        page_times.append(time.perf_counter() - start)
+
+    # Time updating the scores of existing posts
+    update_times = []
+    now = utc_now()
+    for post_id in rng.integers(0, len(feed_index), 1000):
+        start = time.perf_counter()
+        feed_index.upsert(
+            int(post_id),
+            f"at://did:plc:benchmark/app.bsky.feed.post/{post_id}",
+            float(rng.random()),
+            now)
+        update_times.append(time.perf_counter() - start)
+
+    return {
+        "page_p50_us": 1e6 * np.percentile(page_times, 50),
+        "page_p99_us": 1e6 * np.percentile(page_times, 99),
+        "update_p50_us": 1e6 * np.percentile(update_times, 50),
+        "update_p99_us": 1e6 * np.percentile(update_times, 99),
+    }
+
+# Load test server -----------------------------------------------------------
+
+async def run_client(
+        host: str,
+        port: int,
+        feed: str,
+        limit: int,
+        pages: int,
+        deadline: float,
+        latencies: list) -> None:
+
+    reader, writer = await asyncio.open_connection(host, port)
+    cursor = None
+    page = 0
+
+    try:
+        while time.perf_counter() < deadline:
+
+            # Start again from the top after reading enough pages
+            if page == pages:
+                cursor = None
+                page = 0
+
+            target = f"{FEED_SKELETON_PATH}?feed={quote(feed)}&limit={limit}"
+            if cursor is not None:
+                target += f"&cursor={quote(cursor)}"
+
+            start = time.perf_counter()
+            writer.write(
+                f"GET {target} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode())
+            await writer.drain()
+
+            # Read the status line, headers and body
+            await reader.readline()
+            content_length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b""):
+                    break
+                name, value = line.decode().split(":", 1)
+                if name.lower() == "content-length":
+                    content_length = int(value)
+            body = await reader.readexactly(content_length)
+            latencies.append(time.perf_counter() - start)
+
+            cursor = json.loads(body).get("cursor")
+            page += 1
+
+    finally:
+        writer.close()
+
+async def load_test(
+        url: str,
+        feed: str,
+        connections: int,
+        duration: float,
+        limit: int,
+        pages: int) -> dict:
+
+    address = urlsplit(url)
+    latencies = []
+    deadline = time.perf_counter() + duration
+
+    await asyncio.gather(*(run_client(
+        address.hostname,
+        address.port or 80,
+        feed,
+        limit,
+        pages,
+        deadline,
+        latencies) for _ in range(connections)))
+
+    return {
+        "requests": len(latencies),
+        "requests_per_second": len(latencies) / duration,
+        "latency_p50_ms": 1000 * np.percentile(latencies, 50),
+        "latency_p95_ms": 1000 * np.percentile(latencies, 95),
+        "latency_p99_ms": 1000 * np.percentile(latencies, 99),
+    }
+
+# Print results --------------------------------------------------------------
+
+def print_results(title: str, results: dict) -> None:
+    print(title)
+    for key, value in results.items():
+        print(f"  {key}: {value:.3f}")
+
+# Main -----------------------------------------------------------------------
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--index-size", type=int, default=100000)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument(
+        "--url",
+        help="load test a running feed server, e.g. http://127.0.0.1:8000")
+    parser.add_argument("--feed", default="")
+    parser.add_argument("--connections", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    feed_index = create_index(args.index_size)
+    print(f"Created index of {len(feed_index)} posts "
+        f"in {time.perf_counter() - start:.3f}s")
+
+    print_results(
+        "In memory index",
+        time_index(feed_index, args.pages * 100, args.limit))
+
+    if args.url:
+        print_results(
+            f"Feed server at {args.url}",
+            asyncio.run(load_test(
+                args.url,
+                args.feed,
+                args.connections,
+                args.duration,
+                args.limit,
+                args.pages)))
@@ -0,0 +1,777 @@
+"""Load test the stream and process entry points against local stand-ins for
+the firehose, the Bluesky API and the image CDN"""
+
+# Imports --------------------------------------------------------------------
+
+import abc
+import argparse
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import os
+import re
+import signal
+import struct
+import sys
+import tempfile
+import time
+import libipld
+import numpy as np
+
+from datetime import datetime
+from datetime import timezone
+from dotenv import dotenv_values
+from dotenv import load_dotenv
+from PIL import Image
+from typing import Iterator
+from urllib.parse import parse_qs
+from urllib.parse import urlsplit
+from websockets.asyncio.client import connect as websocket_connect
+from websockets.asyncio.server import ServerConnection
+from websockets.asyncio.server import serve as websocket_serve
+
+from skyfilter import database as db
+from skyfilter.latency import get_stage_latencies
+from skyfilter.latency import print_report
+from skyfilter.utils import utc_now
+
+# Setup ----------------------------------------------------------------------
+
+# Load environment variables
+load_dotenv()
+
+# Constants ------------------------------------------------------------------
+
+FIREHOSE_URI = "wss://bsky.network/xrpc/com.atproto.sync.subscribeRepos"
+
+# Recorded frames are stored one after another with a length prefix
+FRAME_HEADER = struct.Struct(">I")
+
+TID_CHARS = "234567abcdefghijklmnopqrstuvwxyz"
+
+# libipld cannot encode CID links, so links are encoded as byte strings and
+# tagged as links afterwards. Links inside blocks that were encoded already
+# are tagged already and are skipped
+LINK_PATTERN = re.compile(
+    rb"(?<!\xd8\x2a)(?=\x58\x25\x00\x01[\x55\x71]\x12\x20)")
+
+CODEC_RAW = 0x55
+CODEC_DAG_CBOR = 0x71
+
+FULLSIZE_IMAGE_SIZE = (2000, 1500)
+THUMBNAIL_IMAGE_SIZE = (1000, 750)
+
+# Stream and process write their logs here, so the logs of running services
+# are not overwritten
+LOG_DIR = os.path.join("logs", "loadtest")
+
+# Encoding -------------------------------------------------------------------
+
+def encode_varint(value: int) -> bytes:
+    encoded = bytearray()
+    while value > 0x7f:
+        encoded.append((value & 0x7f) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+def get_cid(data: bytes, codec: int = CODEC_DAG_CBOR) -> bytes:
+    return bytes([1, codec, 0x12, 0x20]) + hashlib.sha256(data).digest()
+
+def get_link(cid: bytes) -> bytes:
+    return b"\x00" + cid
+
+def encode_dag_cbor(data: dict) -> bytes:
+    return LINK_PATTERN.sub(b"\xd8\x2a", libipld.encode_dag_cbor(data))
+
+def get_tid(timestamp: float, clock_id: int = 0) -> str:
+    value = (int(timestamp * 1e6) << 10) | clock_id
+    return "".join(
+        TID_CHARS[(value >> (5 * i)) & 31] for i in reversed(range(13)))
+
+def get_timestamp() -> str:
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+def encode_car(root: bytes, blocks: list) -> bytes:
+    header = encode_dag_cbor({"roots": [get_link(root)], "version": 1})
+    car = encode_varint(len(header)) + header
+    for cid, data in blocks:
+        car += encode_varint(len(cid) + len(data)) + cid + data
+    return car
+
+def encode_commit_frame(seq: int, repo: str, ops: list) -> bytes:
+
+    """
+    Encode a commit message frame for a list of (action, path, record) ops.
+    Records are None for deletes.
+    """
+
+    now = time.time()
+    rev = get_tid(now, seq % 1024)
+    blocks = []
+    repo_ops = []
+
+    for action, path, record in ops:
+        cid = None
+        if record is not None:
+            data = encode_dag_cbor(record)
+            cid = get_cid(data)
+            blocks.append((cid, data))
+        repo_ops.append({
+            "action": action,
+            "path": path,
+            "cid": None if cid is None else get_link(cid)})
+
+    # The commit block is the root of the CAR file
+    commit = encode_dag_cbor({
+        "did": repo,
+        "version": 3,
+        "data": get_link(get_cid(repo.encode())),
+        "rev": rev,
+        "prev": None,
+        "sig": bytes(64)})
+    commit_cid = get_cid(commit)
+
+    body = {
+        "seq": seq,
+        "rebase": False,
+        "tooBig": False,
+        "repo": repo,
+        "commit": get_link(commit_cid),
+        "rev": rev,
+        "since": None,
+        "blocks": encode_car(commit_cid, [(commit_cid, commit)] + blocks),
+        "ops": repo_ops,
+        "blobs": [],
+        "time": get_timestamp()}
+
+    return encode_dag_cbor({"op": 1, "t": "#commit"}) + encode_dag_cbor(body)
+
+# Synthetic frames -----------------------------------------------------------
+
+def synthetic_frames(
+        image_share: float = 0.5,
+        delete_share: float = 0.05,
+        repos: int = 1000,
+        seed: int = 0) -> Iterator[bytes]:
+
+    """
+    Generate commits that each create or delete one post. Posts with images
+    pass the default filter rules and posts without images do not. Deletes
+    are for posts created earlier in the run.
+    """
+
+    rng = np.random.default_rng(seed)
+    paths = []
+    seq = 0
+
+    while True:
+
+        seq += 1
+        repo = f"did:plc:loadtest{rng.integers(repos)}"
+
+        # Delete an earlier post
+        if paths and rng.random() < delete_share:
+            repo, path = paths.pop(rng.integers(len(paths)))
+            yield encode_commit_frame(seq, repo, [("delete", path, None)])
+            continue
+
+        # Create a post, with an image or without one
+        path = f"app.bsky.feed.post/{get_tid(time.time(), seq % 1024)}"
+        record = {
+            "$type": "app.bsky.feed.post",
+            "text": f"Load test post {seq}",
+            "langs": ["en"],
+            "createdAt": get_timestamp()}
+
+        if rng.random() < image_share:
+            record["embed"] = {
+                "$type": "app.bsky.embed.images",
+                "images": [{
+                    "alt": "",
+                    "image": {
+                        "$type": "blob",
+                        "ref": get_link(get_cid(path.encode(), CODEC_RAW)),
+                        "mimeType": "image/jpeg",
+                        "size": 1}}]}
+
+        paths.append((repo, path))
+        yield encode_commit_frame(seq, repo, [("create", path, record)])
+
+# Recorded frames ------------------------------------------------------------
+
+async def record_frames(path: str, seconds: float) -> int:
+
+    # Save raw frames from the Bluesky firehose for the given time
+    count = 0
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + seconds
+
+    async with websocket_connect(FIREHOSE_URI, max_size=None) as websocket:
+        with open(path, "wb") as f:
+            while loop.time() < deadline:
+                frame = await websocket.recv()
+                f.write(FRAME_HEADER.pack(len(frame)) + frame)
+                count += 1
+
+    return count
+
+def recorded_frames(path: str) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        while header := f.read(FRAME_HEADER.size):
+            (length,) = FRAME_HEADER.unpack(header)
+            yield f.read(length)
+
+# Fake firehose class --------------------------------------------------------
+
+class FakeFirehose:
+
+    """
+    Sends frames to subscribers at a fixed rate once started, until stopped
+    or the frames run out.
+    """
+
+    def __init__(self, frames: Iterator[bytes], rate: float) -> None:
+        self.frames = frames
+        self.rate = rate
+        self.sent = 0
+        self.started = asyncio.Event()
+        self.stopped = False
+        self.start_time = 0.0
+
+    def start(self) -> None:
+        self.start_time = asyncio.get_running_loop().time()
+        self.started.set()
+
+    async def handle_connection(self, websocket: ServerConnection) -> None:
+
+        loop = asyncio.get_running_loop()
+        await self.started.wait()
+
+        # Send the frames that are due every 10ms
+        while not self.stopped:
+            due = int(self.rate * (loop.time() - self.start_time)) - self.sent
+            for _ in range(due):
+                frame = next(self.frames, None)
+                if frame is None:
+                    self.stopped = True
+                    break
+                await websocket.send(frame)
+                self.sent += 1
+            await asyncio.sleep(0.01)
+
+        # Keep the connection open so the stream does not reconnect
+        await websocket.wait_closed()
+
+# Fake service class ---------------------------------------------------------
+
+class FakeService(abc.ABC):
+
+    """
+    Answers HTTP/1.1 requests with keep-alive after a random delay with the
+    given mean, and fails the given share of requests with a server error.
+    """
+
+    def __init__(
+            self,
+            latency: float = 0,
+            error_rate: float = 0,
+            seed: int = 0) -> None:
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = np.random.default_rng(seed)
+        self.requests = 0
+        self.errors = 0
+
+    async def handle_connection(
+            self,
+            reader: asyncio.StreamReader,
+            writer: asyncio.StreamWriter) -> None:
+
+        try:
+            while True:
+
+                # Read the request line, headers and body
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode().split()
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, value = line.decode().split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+
+                body = await reader.readexactly(
+                    int(headers.get("content-length", 0)))
+
+                # Wait, then respond or fail
+                self.requests += 1
+                if self.latency > 0:
+                    await asyncio.sleep(self.rng.exponential(self.latency))
+
+                if self.rng.random() < self.error_rate:
+                    self.errors += 1
+                    status, content_type, content = json_response(
+                        {"error": "InternalServerError"},
+                        "500 Internal Server Error")
+                else:
+                    status, content_type, content = self.route(
+                        method,
+                        target,
+                        body)
+
+                writer.write(
+                    f"HTTP/1.1 {status}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(content)}\r\n"
+                    f"Connection: keep-alive\r\n\r\n".encode() + content)
+                await writer.drain()
+
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+            pass
+
+        finally:
+            writer.close()
+
+    @abc.abstractmethod
+    def route(
+            self,
+            method: str,
+            target: str,
+            body: bytes) -> tuple[str, str, bytes]:
+        pass
+
+# Responses ------------------------------------------------------------------
+
+def json_response(
+        data: dict,
+        status: str = "200 OK") -> tuple[str, str, bytes]:
+    return status, "application/json", json.dumps(data).encode("utf-8")
+
+# Fake AppView class ---------------------------------------------------------
+
+class FakeAppView(FakeService):
+
+    """
+    Creates sessions, answers profile requests, and answers getPostThread and
+    getPosts requests for any post URI with a post that has images on the
+    fake CDN.
+    """
+
+    def __init__(
+            self,
+            cdn_url: str,
+            images_per_post: int = 1,
+            latency: float = 0,
+            error_rate: float = 0) -> None:
+        super().__init__(latency, error_rate, seed=1)
+        self.cdn_url = cdn_url
+        self.images_per_post = images_per_post
+
+    def route(
+            self,
+            method: str,
+            target: str,
+            body: bytes) -> tuple[str, str, bytes]:
+
+        url = urlsplit(target)
+        params = parse_qs(url.query)
+
+        if url.path == "/xrpc/com.atproto.server.createSession":
+            return json_response(get_session(json.loads(body)["identifier"]))
+
+        if url.path == "/xrpc/app.bsky.actor.getProfile":
+            actor = params["actor"][0]
+            return json_response({"did": "did:plc:loadtest", "handle": actor})
+
+        if url.path == "/xrpc/app.bsky.feed.getPostThread":
+            return json_response({"thread": {
+                "$type": "app.bsky.feed.defs#threadViewPost",
+                "post": self.get_post_view(params["uri"][0])}})
+
+        if url.path == "/xrpc/app.bsky.feed.getPosts":
+            return json_response({"posts": [
+                self.get_post_view(uri) for uri in params.get("uris", [])]})
+
+        return json_response(
+            {"error": "MethodNotImplemented", "message": url.path},
+            "501 Not Implemented")
+
+    def get_post_view(self, uri: str) -> dict:
+
+        did = uri.split("/")[2]
+        now = get_timestamp()
+
+        # Give each image the CID the post would have
+        images = []
+        for i in range(self.images_per_post):
+            cid = libipld.encode_cid(get_cid(f"{uri}/{i}".encode(), CODEC_RAW))
+            images.append({
+                "thumb": f"{self.cdn_url}/img/feed_thumbnail/plain/"
+                    f"{did}/{cid}@jpeg",
+                "fullsize": f"{self.cdn_url}/img/feed_fullsize/plain/"
+                    f"{did}/{cid}@jpeg",
+                "alt": "",
+                "aspectRatio": {
+                    "width": FULLSIZE_IMAGE_SIZE[0],
+                    "height": FULLSIZE_IMAGE_SIZE[1]}})
+
+        return {
+            "uri": uri,
+            "cid": libipld.encode_cid(get_cid(uri.encode())),
+            "author": {"did": did, "handle": f"{did.split(':')[-1]}.test"},
+            "record": {
+                "$type": "app.bsky.feed.post",
+                "text": "",
+                "createdAt": now},
+            "embed": {"$type": "app.bsky.embed.images#view", "images": images},
+            "indexedAt": now}
+
+def get_session(identifier: str) -> dict:
+
+    # The client reads the expiry time from the access token
+    did = "did:plc:loadtest"
+    now = int(time.time())
+    return {
+        "did": did,
+        "handle": identifier,
+        "accessJwt": encode_jwt({
+            "scope": "com.atproto.access",
+            "sub": did,
+            "iat": now,
+            "exp": now + 86400}),
+        "refreshJwt": encode_jwt({
+            "scope": "com.atproto.refresh",
+            "sub": did,
+            "iat": now,
+            "exp": now + 86400})}
+
+def encode_jwt(payload: dict) -> str:
+    return ".".join(
+        base64.urlsafe_b64encode(json.dumps(part).encode()).decode().rstrip("=")
+        for part in ({"alg": "none", "typ": "JWT"}, payload)) + ".loadtest"
+
+# Fake CDN class -------------------------------------------------------------
+
+class FakeCDN(FakeService):
+
+    """
+    Serves an image from a pool for any image URL, choosing the image from
+    the name in the URL so the same URL always gets the same image.
+    """
+
+    def __init__(
+            self,
+            fullsize_images: list,
+            thumbnail_images: list,
+            latency: float = 0,
+            error_rate: float = 0) -> None:
+        super().__init__(latency, error_rate, seed=2)
+        self.fullsize_images = fullsize_images
+        self.thumbnail_images = thumbnail_images
+
+    def route(
+            self,
+            method: str,
+            target: str,
+            body: bytes) -> tuple[str, str, bytes]:
+
+        path = urlsplit(target).path
+        images = self.thumbnail_images \
+            if "/feed_thumbnail/" in path else self.fullsize_images
+        digest = hashlib.sha256(path.split("/")[-1].encode()).digest()
+        i = int.from_bytes(digest[:4], "big") % len(images)
+        return "200 OK", "image/jpeg", images[i]
+
+# Images ---------------------------------------------------------------------
+
+def encode_jpeg(image: Image.Image, size: tuple) -> bytes:
+    image = image.convert("RGB")
+    image.thumbnail(size)
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+def create_images(count: int, seed: int = 0) -> list:
+
+    # Scale up low resolution noise so the images compress like photos
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        noise = rng.integers(0, 256, (30, 40, 3), dtype=np.uint8)
+        images.append(Image.fromarray(noise).resize(
+            FULLSIZE_IMAGE_SIZE,
+            Image.Resampling.BICUBIC))
+    return images
+
+def load_images(images_dir: str, count: int) -> list:
+    image_paths = sorted(
+        os.path.join(images_dir, name) for name in os.listdir(images_dir)
+        if name.lower().endswith((".jpeg", ".jpg", ".png")))
+    return [Image.open(image_path) for image_path in image_paths[:count]]
+
+# Run entry points -----------------------------------------------------------
+
+async def start_entry_point(
+        module: str,
+        env: dict) -> asyncio.subprocess.Process:
+
+    # Wait for the entry point to report that it is running
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, "-m", module,
+        env=env,
+        stdout=asyncio.subprocess.PIPE)
+    line = await proc.stdout.readline()
+    if not line:
+        raise RuntimeError(f"{module} exited before it was running")
+    return proc
+
+async def stop_entry_point(proc: asyncio.subprocess.Process) -> None:
+    proc.send_signal(signal.SIGINT)
+    await proc.wait()
+
+async def wait_for_backlog(since: datetime, timeout: float) -> int:
+
+    # Wait until the processor has caught up with the recorded posts, and 
+    # return the number of posts still waiting if it has not
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    sql = """
+        SELECT count(*) AS posts
+        FROM posts
+        WHERE
+            received_at >= (%s) AND
+            post_status_id IN (%s, %s);
+        """
+    params = (since, db.POST_STATUS_UNCATALOGUED, db.POST_STATUS_IN_PROGRESS)
+    while True:
+        rows = await db.fetch_all(sql, params)
+        backlog = rows[0]["posts"]
+        if backlog == 0 or loop.time() >= deadline:
+            return backlog
+        await asyncio.sleep(1)
+
+# Report ---------------------------------------------------------------------
+
+async def get_status_counts(since: datetime) -> list:
+    sql = """
+        SELECT
+            post_statuses.status_name,
+            count(*) AS posts
+        FROM posts
+        JOIN post_statuses ON post_statuses.status_id = posts.post_status_id
+        WHERE posts.received_at >= (%s)
+        GROUP BY post_statuses.status_id
+        ORDER BY post_statuses.status_id;
+        """
+    return await db.fetch_all(sql, (since,))
+
+async def get_throughput(since: datetime, duration: float) -> dict:
+    sql = """
+        SELECT
+            count(*) AS received,
+            count(persisted_at) AS persisted,
+            EXTRACT(EPOCH FROM (max(persisted_at) - (%s))) AS persist_seconds
+        FROM posts
+        WHERE received_at >= (%s);
+        """
+    rows = await db.fetch_all(sql, (since, since))
+    row = rows[0]
+    persist_seconds = float(row["persist_seconds"] or 0)
+    return {
+        "recorded": row["received"],
+        "recorded_per_second": row["received"] / duration,
+        "persisted": row["persisted"],
+        "persisted_per_second": row["persisted"] / persist_seconds \
+            if persist_seconds > 0 else 0,
+    }
+
+def print_results(title: str, results: dict) -> None:
+    print(title)
+    for key, value in results.items():
+        if isinstance(value, float):
+            print(f"  {key}: {value:.3f}")
+        else:
+            print(f"  {key}: {value}")
+
+# Main -----------------------------------------------------------------------
+
+async def main(args: argparse.Namespace) -> None:
+
+    # Use the separate load test database
+    os.environ["SF_DB_NAME"] = args.db_name
+
+    # Create the image pool
+    if args.cdn_images_dir:
+        images = load_images(args.cdn_images_dir, args.image_pool_size)
+    else:
+        images = create_images(args.image_pool_size)
+
+    # Start the fake CDN
+    cdn = FakeCDN(
+        [encode_jpeg(image, FULLSIZE_IMAGE_SIZE) for image in images],
+        [encode_jpeg(image, THUMBNAIL_IMAGE_SIZE) for image in images],
+        args.cdn_latency,
+        args.cdn_error_rate)
+    cdn_server = await asyncio.start_server(
+        cdn.handle_connection, "127.0.0.1", 0)
+    cdn_url = f"http://127.0.0.1:{cdn_server.sockets[0].getsockname()[1]}"
+
+    # Start the fake AppView
+    appview = FakeAppView(
+        cdn_url,
+        args.images_per_post,
+        args.appview_latency,
+        args.appview_error_rate)
+    appview_server = await asyncio.start_server(
+        appview.handle_connection, "127.0.0.1", 0)
+    appview_port = appview_server.sockets[0].getsockname()[1]
+
+    # Start the fake firehose
+    if args.replay:
+        frames = recorded_frames(args.replay)
+    else:
+        frames = synthetic_frames(args.image_share, args.delete_share)
+    firehose = FakeFirehose(frames, args.rate)
+    firehose_server = await websocket_serve(
+        firehose.handle_connection, "127.0.0.1", 0)
+    firehose_port = firehose_server.sockets[0].getsockname()[1]
+
+    # Keep the images and logs of the entry points apart from those of the 
+    # running services. The images are removed when the load test ends
+    images_dir = tempfile.TemporaryDirectory(prefix="skyfilter-loadtest-")
+    os.makedirs(LOG_DIR, exist_ok=True)
+
+    # Point the entry points at the fakes
+    env = dict(
+        os.environ,
+        PYTHONUNBUFFERED="1",
+        SF_FIREHOSE_URI=f"ws://127.0.0.1:{firehose_port}/xrpc",
+        SF_BSKY_BASE_URL=f"http://127.0.0.1:{appview_port}/xrpc",
+        SF_BSKY_USER="loadtest.test",
+        SF_BSKY_PASS="loadtest",
+        SF_DB_IMAGES_DIR=images_dir.name,
+        SF_LOG_DIR=LOG_DIR)
+
+    await db.open_pool(max_size=1)
+
+    # Stop the entry points that started if either of them fails
+    print("Starting stream and process")
+    procs = []
+    try:
+        for module in ("skyfilter.stream", "skyfilter.process"):
+            procs.append(await start_entry_point(module, env))
+
+        # Send frames for the duration, then wait for the backlog to clear
+        print(f"Sending {args.rate} commits per second for {args.duration}s")
+        started_at = utc_now()
+        firehose.start()
+        await asyncio.sleep(args.duration)
+        firehose.stopped = True
+
+        print("Waiting for the backlog to clear")
+        backlog = await wait_for_backlog(started_at, args.drain)
+        if backlog > 0:
+            print(
+                f"Warning: {backlog} posts were still waiting to be "
+                f"processed after {args.drain}s, so the results below do "
+                f"not include them")
+
+    finally:
+        for proc in procs:
+            await stop_entry_point(proc)
+        images_dir.cleanup()
+        print(f"Stream and process logs written to {LOG_DIR}")
+
+    # Report results
+    print_results("Stand-ins", {
+        "firehose_frames": firehose.sent,
+        "appview_requests": appview.requests,
+        "appview_errors": appview.errors,
+        "cdn_requests": cdn.requests,
+        "cdn_errors": cdn.errors,
+    })
+    print_results(
+        "Throughput",
+        await get_throughput(started_at, args.duration))
+    print_results("Post statuses", {
+        row["status_name"]: row["posts"]
+        for row in await get_status_counts(started_at)})
+    print_report(
+        await get_stage_latencies(utc_now() - started_at),
+        utc_now() - started_at)
+
+    await db.close_pool()
+    firehose_server.close()
+    appview_server.close()
+    cdn_server.close()
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--duration", type=float, default=60)
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=50,
+        help="firehose commits per second")
+    parser.add_argument(
+        "--image-share",
+        type=float,
+        default=0.5,
+        help="share of synthetic posts with images")
+    parser.add_argument(
+        "--delete-share",
+        type=float,
+        default=0.05,
+        help="share of synthetic commits that delete a post")
+    parser.add_argument(
+        "--replay",
+        help="replay frames recorded with --record instead of synthetic ones")
+    parser.add_argument(
+        "--record",
+        help="record frames from the Bluesky firehose to this file and exit")
+    parser.add_argument("--record-seconds", type=float, default=60)
+    parser.add_argument("--images-per-post", type=int, default=1)
+    parser.add_argument("--appview-latency", type=float, default=0.05)
+    parser.add_argument("--appview-error-rate", type=float, default=0)
+    parser.add_argument("--cdn-latency", type=float, default=0.05)
+    parser.add_argument("--cdn-error-rate", type=float, default=0.01)
+    parser.add_argument(
+        "--cdn-images-dir",
+        help="serve images from this directory instead of synthetic ones")
+    parser.add_argument("--image-pool-size", type=int, default=20)
+    parser.add_argument(
+        "--drain",
+        type=float,
+        default=60,
+        help="seconds to wait for the backlog to clear after sending")
+    parser.add_argument(
+        "--db-name",
+        help="separate database for the load test, which must not be "
+            "SF_DB_NAME (required unless recording)")
+    args = parser.parse_args()
+
+    # The processor would claim and classify real posts with the fake API 
+    # and CDN, so never run the load test against the configured database
+    if not args.record:
+        if not args.db_name:
+            parser.error("--db-name is required")
+        if args.db_name in (
+                os.getenv("SF_DB_NAME"),
+                dotenv_values().get("SF_DB_NAME")):
+            parser.error(
+                f"--db-name must not be the configured database "
+                f"{args.db_name}")
+
+    if args.record:
+        count = asyncio.run(record_frames(args.record, args.record_seconds))
+        print(f"Recorded {count} frames to {args.record}")
+    else:
+        asyncio.run(main(args))
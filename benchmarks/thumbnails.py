@@ -0,0 +1,149 @@
+"""Compare image scores from thumbnails with scores from full size images"""
+
+# Imports --------------------------------------------------------------------
+
+import argparse
+import asyncio
+import os
+import numpy as np
+import requests
+import tempfile
+
+from dotenv import load_dotenv
+
+from skyfilter import database as db
+from skyfilter.models import load_predictor
+from skyfilter.models import predict_image_scores
+from skyfilter.process import DROP_THRESHOLD
+
+# Setup ----------------------------------------------------------------------
+
+# Load environment variables
+load_dotenv()
+
+# Get thumbnail url ----------------------------------------------------------
+
+def get_thumbnail_url(image_url: str) -> str:
+    return image_url.replace("/feed_fullsize/", "/feed_thumbnail/")
+
+# Get sample -----------------------------------------------------------------
+
+async def get_sample(sample_size: int) -> list:
+    sql = """
+        SELECT 
+            image_id,
+            image_url,
+            image_filepath
+        FROM images 
+        ORDER BY random() 
+        LIMIT (%s);
+        """
+    return await db.fetch_all(sql, (sample_size,))
+
+# Download thumbnails --------------------------------------------------------
+
+def download_thumbnails(images: list, thumbnail_dir: str) -> list:
+
+    # Keep images whose full size file exists and whose thumbnail downloads
+    downloaded = []
+
+    for image in images:
+        if not os.path.exists(image["image_filepath"]):
+            continue
+        try:
+            response = requests.get(
+                get_thumbnail_url(image["image_url"]),
+                allow_redirects=True,
+                timeout=60)
+            if response.status_code != 200:
+                continue
+            thumbnail_path = os.path.join(
+                thumbnail_dir, 
+                f"{image['image_id']}.jpeg")
+            with open(thumbnail_path, "wb") as f:
+                f.write(response.content)
+            downloaded.append({**image, "thumbnail_path": thumbnail_path})
+        except Exception as e:
+            print(f"Error downloading thumbnail: {e}")
+
+    return downloaded
+
+# Score images ---------------------------------------------------------------
+
+def score_images(
+        predictor,
+        image_paths: list,
+        batch_size: int = 16) -> np.ndarray:
+    scores = []
+    for i in range(0, len(image_paths), batch_size):
+        scores += predict_image_scores(predictor, image_paths[i:i + batch_size])
+    return np.array(scores)
+
+# Get report -----------------------------------------------------------------
+
+def get_report(
+        fullsize_scores: np.ndarray,
+        thumbnail_scores: np.ndarray,
+        threshold: float = DROP_THRESHOLD) -> dict:
+
+    abs_diff = np.abs(thumbnail_scores - fullsize_scores)
+    fullsize_kept = fullsize_scores >= threshold
+    thumbnail_kept = thumbnail_scores >= threshold
+
+    return {
+        "images": len(fullsize_scores),
+        "mean_abs_diff": float(np.mean(abs_diff)),
+        "p95_abs_diff": float(np.percentile(abs_diff, 95)),
+        "max_abs_diff": float(np.max(abs_diff)),
+        "correlation": float(
+            np.corrcoef(fullsize_scores, thumbnail_scores)[0, 1]),
+        "threshold": threshold,
+        "agreement": float(np.mean(fullsize_kept == thumbnail_kept)),
+        "below_with_thumbnail_only": int(
+            np.sum(fullsize_kept & ~thumbnail_kept)),
+        "above_with_thumbnail_only": int(
+            np.sum(~fullsize_kept & thumbnail_kept)),
+    }
+
+def print_report(report: dict) -> None:
+    print("Thumbnail validation report")
+    for key, value in report.items():
+        if isinstance(value, float):
+            value = f"{value:.4f}"
+        print(f"  {key}: {value}")
+
+# Main -----------------------------------------------------------------------
+
+async def main(sample_size: int) -> None:
+
+    # Get a sample of classified images
+    await db.open_pool()
+    images = await get_sample(sample_size)
+    await db.close_pool()
+
+    predictor = load_predictor()
+
+    with tempfile.TemporaryDirectory() as thumbnail_dir:
+
+        # Download the thumbnails for the sample
+        images = download_thumbnails(images, thumbnail_dir)
+
+        if len(images) < 2:
+            print("Not enough images to compare")
+            return
+
+        # Score the full size images and the thumbnails
+        fullsize_scores = score_images(
+            predictor, 
+            [image["image_filepath"] for image in images])
+        thumbnail_scores = score_images(
+            predictor, 
+            [image["thumbnail_path"] for image in images])
+
+    print_report(get_report(fullsize_scores, thumbnail_scores))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sample-size", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.sample_size))
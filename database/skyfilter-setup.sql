@@ -6,4 +6,6 @@ INSERT INTO post_statuses (status_name) VALUES ('Fetch post error');
 INSERT INTO post_statuses (status_name) VALUES ('Fetch image error');
 INSERT INTO post_statuses (status_name) VALUES ('Classify image error');
 INSERT INTO post_statuses (status_name) VALUES ('Dropped');
-INSERT INTO post_statuses (status_name) VALUES ('Complete');
\ No newline at end of file
+INSERT INTO post_statuses (status_name) VALUES ('Complete');
+INSERT INTO post_statuses (status_name) VALUES ('Deleted');
+INSERT INTO post_statuses (status_name) VALUES ('In progress');
\ No newline at end of file
@@ -13,11 +13,25 @@ CREATE TABLE posts(
     post_text text NOT NULL,
     post_created_at timestamp NOT NULL,
     post_status_id int NOT NULL DEFAULT 1,
+    received_at timestamp,
+    recorded_at timestamp,
+    claimed_at timestamp,
+    hydrated_at timestamp,
+    downloaded_at timestamp,
+    classified_at timestamp,
+    fullsize_downloaded_at timestamp,
+    persisted_at timestamp,
     created_at timestamp NOT NULL DEFAULT now(),
     updated_at timestamp NOT NULL DEFAULT now(),
     FOREIGN KEY(post_status_id) REFERENCES post_statuses(status_id)
 );
 
+--index posts by time processed for latency reports
+CREATE INDEX posts_persisted_at_idx ON posts (persisted_at);
+
+--index posts by time updated for feed refreshes
+CREATE INDEX posts_updated_at_idx ON posts (updated_at);
+
 --create images
 CREATE TABLE images(
     image_id serial PRIMARY KEY,
@@ -0,0 +1,29 @@
+--upgrade an existing database to the current schema
+
+--add deleted post status
+INSERT INTO post_statuses (status_name) 
+SELECT 'Deleted' 
+WHERE NOT EXISTS (
+    SELECT 1 FROM post_statuses WHERE status_name = 'Deleted');
+
+--add in progress post status for posts claimed by a processor
+INSERT INTO post_statuses (status_name) 
+SELECT 'In progress' 
+WHERE NOT EXISTS (
+    SELECT 1 FROM post_statuses WHERE status_name = 'In progress');
+
+--add post stage timestamps (UTC)
+ALTER TABLE posts 
+    ADD COLUMN IF NOT EXISTS received_at timestamp,
+    ADD COLUMN IF NOT EXISTS recorded_at timestamp,
+    ADD COLUMN IF NOT EXISTS claimed_at timestamp,
+    ADD COLUMN IF NOT EXISTS hydrated_at timestamp,
+    ADD COLUMN IF NOT EXISTS downloaded_at timestamp,
+    ADD COLUMN IF NOT EXISTS classified_at timestamp,
+    ADD COLUMN IF NOT EXISTS fullsize_downloaded_at timestamp,
+    ADD COLUMN IF NOT EXISTS persisted_at timestamp;
+
+CREATE INDEX IF NOT EXISTS posts_persisted_at_idx ON posts (persisted_at);
+
+--add index on time updated for feed refreshes
+CREATE INDEX IF NOT EXISTS posts_updated_at_idx ON posts (updated_at);
@@ -0,0 +1,3 @@
+#!/bin/zsh
+
+psql -U admin -d skyfilter -f ./database/skyfilter-upgrade.sql
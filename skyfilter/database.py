@@ -2,9 +2,24 @@
 
 # Imports --------------------------------------------------------------------
 
+import logging
 import os
+import psycopg
 
+from psycopg import AsyncConnection
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+from typing import Any
+from typing import Awaitable
+from typing import Callable
 from typing import Final
+from typing import Mapping
+from typing import Sequence
+
+# Setup ----------------------------------------------------------------------
+
+# Create logger
+logger = logging.getLogger(__name__)
 
 # Constants ------------------------------------------------------------------
 
@@ -15,6 +30,11 @@ POST_STATUS_FETCH_IMAGE_ERROR: Final[int] = 4
 POST_STATUS_CLASSIFY_IMAGE_ERROR: Final[int] = 5
 POST_STATUS_DROPPED: Final[int] = 6
 POST_STATUS_COMPLETE: Final[int] = 7
+POST_STATUS_DELETED: Final[int] = 8
+POST_STATUS_IN_PROGRESS: Final[int] = 9
+
+# Connection pool shared by all database calls in a process
+_pool: AsyncConnectionPool | None = None
 
 # Functions ------------------------------------------------------------------
 
@@ -26,6 +46,93 @@ def get_connection_string() -> str:
         f"dbname={os.getenv('SF_DB_NAME')} " \
         f"user={os.getenv('SF_DB_USER')} " \
         f"password={os.getenv('SF_DB_PASS')} "
-    
+
     return connection_string
-        
\ No newline at end of file
+
+# Connection pool ------------------------------------------------------------
+
+async def open_pool(
+        min_size: int = 1,
+        max_size: int = 4,
+        reconnect_timeout: float = 300) -> AsyncConnectionPool:
+
+    """
+    Open the connection pool. Connections are checked before they are handed
+    out and replaced if they are broken, and every statement is prepared on
+    the server the first time a connection executes it.
+    """
+
+    global _pool
+
+    _pool = AsyncConnectionPool(
+        get_connection_string(),
+        min_size=min_size,
+        max_size=max_size,
+        reconnect_timeout=reconnect_timeout,
+        check=AsyncConnectionPool.check_connection,
+        kwargs={"prepare_threshold": 0},
+        open=False)
+
+    await _pool.open(wait=True)
+    return _pool
+
+async def close_pool() -> None:
+
+    global _pool
+
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+def get_pool() -> AsyncConnectionPool:
+    if _pool is None:
+        raise RuntimeError("Database connection pool is not open")
+    return _pool
+
+# Queries --------------------------------------------------------------------
+
+async def run_transaction(
+        work: Callable[[AsyncConnection], Awaitable[Any]],
+        retries: int = 1) -> Any:
+
+    """
+    Run work in a transaction on a pooled connection. The transaction is
+    committed if work returns and rolled back if it raises. If the connection
+    fails, work is retried on a new connection.
+    """
+
+    for attempt in range(retries + 1):
+        try:
+            async with get_pool().connection() as conn:
+                return await work(conn)
+        except psycopg.OperationalError as e:
+            if attempt == retries:
+                raise
+            logger.warning(f"Retrying in database.run_transaction: {e}")
+
+async def execute(
+        sql: str,
+        params: Sequence | Mapping | None = None,
+        retries: int = 1) -> int:
+
+    """ Execute a statement and return the number of rows affected. """
+
+    async def work(conn: AsyncConnection) -> int:
+        cur = await conn.execute(sql, params)
+        return cur.rowcount
+
+    return await run_transaction(work, retries)
+
+async def fetch_all(
+        sql: str,
+        params: Sequence | Mapping | None = None,
+        retries: int = 1) -> list:
+
+    """ Execute a query and return the rows as dictionaries. """
+
+    async def work(conn: AsyncConnection) -> list:
+        async with conn.cursor(row_factory=dict_row) as cur:
+            await cur.execute(sql, params)
+            return await cur.fetchall()
+
+    return await run_transaction(work, retries)
@@ -0,0 +1,447 @@
+"""Serve classified posts as a Bluesky feed from an in-memory index"""
+
+# Imports --------------------------------------------------------------------
+
+import asyncio
+import bisect
+import json
+import logging
+import os
+
+from datetime import datetime
+from datetime import timedelta
+from dotenv import load_dotenv
+from urllib.parse import parse_qs
+from urllib.parse import urlsplit
+
+from skyfilter import database as db
+from skyfilter.utils import get_log_path
+from skyfilter.utils import SignalMonitor
+from skyfilter.utils import StartupTimer
+from skyfilter.utils import utc_now
+
+# Setup ----------------------------------------------------------------------
+
+# Load environment variables
+load_dotenv()
+
+# Create logger
+logger = logging.getLogger(__name__)
+
+# Constants ------------------------------------------------------------------
+
+FEED_SKELETON_PATH = "/xrpc/app.bsky.feed.getFeedSkeleton"
+DESCRIBE_FEED_PATH = "/xrpc/app.bsky.feed.describeFeedGenerator"
+DID_DOCUMENT_PATH = "/.well-known/did.json"
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 100
+
+# Status updates are read again for this long after they are first seen, so
+# that updates committed out of order are not missed
+REFRESH_OVERLAP = timedelta(seconds=10)
+
+# Errors ---------------------------------------------------------------------
+
+class BadCursorError(Exception):
+    pass
+
+# Feed index class -----------------------------------------------------------
+
+class FeedIndex:
+
+    """
+    Holds recent complete posts in a list of sort keys ordered by descending
+    score, then descending creation time, then descending post ID. The key of
+    the last post on a page is used as the cursor, so the next page is found
+    with a binary search and a slice.
+    """
+
+    def __init__(
+            self,
+            window: timedelta = timedelta(hours=48),
+            min_score: float = 0) -> None:
+        self.window = window
+        self.min_score = min_score
+        self.keys = []
+        self.post_keys = {}
+        self.post_uris = {}
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def upsert(
+            self,
+            post_id: int,
+            post_uri: str,
+            score: float,
+            created_at: datetime) -> None:
+        self.remove(post_id)
+        key = (-score, -created_at.timestamp(), -post_id)
+        bisect.insort(self.keys, key)
+        self.post_keys[post_id] = key
+        self.post_uris[post_id] = post_uri
+
+    def remove(self, post_id: int) -> None:
+        key = self.post_keys.pop(post_id, None)
+        if key is None:
+            return
+        i = bisect.bisect_left(self.keys, key)
+        del self.keys[i]
+        del self.post_uris[post_id]
+
+    def prune(self, now: datetime) -> None:
+
+        # Remove posts created before the start of the window
+        oldest = -(now - self.window).timestamp()
+        expired = [-key[2] for key in self.keys if key[1] > oldest]
+        for post_id in expired:
+            self.remove(post_id)
+
+    def apply(self, rows: list) -> None:
+
+        # Add complete posts with a high enough score and remove the rest
+        for row in rows:
+            if row["post_status_id"] == db.POST_STATUS_COMPLETE and \
+                    row["score"] is not None and \
+                    row["score"] >= self.min_score:
+                self.upsert(
+                    row["post_id"],
+                    row["post_uri"],
+                    row["score"],
+                    row["post_created_at"])
+            else:
+                self.remove(row["post_id"])
+
+    def get_page(
+            self,
+            limit: int = DEFAULT_LIMIT,
+            cursor: str | None = None) -> tuple[list, str | None]:
+
+        # Start after the cursor, or at the top of the index
+        start = 0
+        if cursor is not None:
+            start = bisect.bisect_right(self.keys, decode_cursor(cursor))
+
+        keys = self.keys[start:start + limit]
+        post_uris = [self.post_uris[-key[2]] for key in keys]
+
+        # Return a cursor unless this is the last page
+        next_cursor = None
+        if start + limit < len(self.keys):
+            next_cursor = encode_cursor(keys[-1])
+
+        return post_uris, next_cursor
+
+# Cursors --------------------------------------------------------------------
+
+def encode_cursor(key: tuple) -> str:
+    return "_".join(repr(-value) for value in key)
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        score, timestamp, post_id = cursor.split("_")
+        return (-float(score), -float(timestamp), -int(post_id))
+    except ValueError:
+        raise BadCursorError(f"Invalid cursor: {cursor}")
+
+# Get recent posts -----------------------------------------------------------
+
+async def get_recent_posts(created_since: datetime) -> tuple[list, datetime]:
+
+    # Get complete posts created since the given time, and the database time 
+    # to read status changes from. The time is read as a timestamp without a
+    # time zone so it can be compared with updated_at
+    sql = """
+        SELECT
+            posts.post_id,
+            posts.post_uri,
+            posts.post_status_id,
+            posts.post_created_at,
+            posts.updated_at,
+            max(images.image_score) AS score
+        FROM posts
+        JOIN images ON images.post_id = posts.post_id
+        WHERE
+            posts.post_created_at >= (%s) AND
+            posts.post_status_id = (%s)
+        GROUP BY posts.post_id;
+        """
+    params = (created_since, db.POST_STATUS_COMPLETE)
+    now = await db.fetch_all("SELECT localtimestamp AS now;")
+    rows = await db.fetch_all(sql, params)
+    return rows, now[0]["now"]
+
+# Get post updates -----------------------------------------------------------
+
+async def get_post_updates(since: datetime) -> list:
+    sql = """
+        SELECT
+            posts.post_id,
+            posts.post_uri,
+            posts.post_status_id,
+            posts.post_created_at,
+            posts.updated_at,
+            max(images.image_score) AS score
+        FROM posts
+        LEFT JOIN images ON images.post_id = posts.post_id
+        WHERE
+            posts.updated_at > (%s) AND
+            posts.post_status_id IN (%s, %s)
+        GROUP BY posts.post_id
+        ORDER BY posts.updated_at;
+        """
+    params = (since, db.POST_STATUS_COMPLETE, db.POST_STATUS_DELETED)
+    return await db.fetch_all(sql, params)
+
+# Feed server class ----------------------------------------------------------
+
+class FeedServer:
+
+    """
+    Answers getFeedSkeleton requests from the index over HTTP/1.1 with
+    keep-alive, and describes the feed generator if a hostname is set.
+    """
+
+    def __init__(
+            self,
+            feed_index: FeedIndex,
+            hostname: str | None = None,
+            feed_uri: str | None = None) -> None:
+        self.feed_index = feed_index
+        self.hostname = hostname
+        self.feed_uri = feed_uri
+
+    async def handle_connection(
+            self,
+            reader: asyncio.StreamReader,
+            writer: asyncio.StreamWriter) -> None:
+
+        try:
+            while True:
+
+                # Read the request line and headers
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, version = request_line.decode().split()
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, value = line.decode().split(":", 1)
+                    headers[name.strip().lower()] = value.strip().lower()
+
+                # Respond and close unless the connection is kept alive
+                status, body = self.route(method, target)
+                keep_alive = headers.get("connection") != "close" and \
+                    version == "HTTP/1.1"
+
+                writer.write(
+                    f"HTTP/1.1 {status}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}"
+                    f"\r\n\r\n".encode() + body)
+                await writer.drain()
+
+                if not keep_alive:
+                    break
+
+        except (ConnectionError, ValueError):
+            pass
+
+        except Exception as e:
+            logger.error(f"Error in feed.handle_connection: {e}")
+
+        finally:
+            writer.close()
+
+    def route(self, method: str, target: str) -> tuple[str, bytes]:
+
+        url = urlsplit(target)
+        params = parse_qs(url.query)
+
+        if method != "GET":
+            return error_response(
+                "405 Method Not Allowed",
+                "MethodNotAllowed",
+                method)
+
+        if url.path == FEED_SKELETON_PATH:
+            return self.get_feed_skeleton(params)
+
+        if url.path == DESCRIBE_FEED_PATH and self.hostname:
+            return json_response({
+                "did": f"did:web:{self.hostname}",
+                "feeds": [{"uri": self.feed_uri}] if self.feed_uri else []})
+
+        if url.path == DID_DOCUMENT_PATH and self.hostname:
+            return json_response({
+                "@context": ["https://www.w3.org/ns/did/v1"],
+                "id": f"did:web:{self.hostname}",
+                "service": [{
+                    "id": "#bsky_fg",
+                    "type": "BskyFeedGenerator",
+                    "serviceEndpoint": f"https://{self.hostname}"}]})
+
+        return error_response("404 Not Found", "NotFound", url.path)
+
+    def get_feed_skeleton(self, params: dict) -> tuple[str, bytes]:
+
+        feed = params.get("feed", [None])[0]
+        if self.feed_uri and feed != self.feed_uri:
+            return error_response(
+                "400 Bad Request",
+                "UnknownFeed",
+                f"Unknown feed: {feed}")
+
+        try:
+            limit = int(params.get("limit", [DEFAULT_LIMIT])[0])
+            limit = max(1, min(limit, MAX_LIMIT))
+            cursor = params.get("cursor", [None])[0]
+            post_uris, next_cursor = self.feed_index.get_page(limit, cursor)
+        except (ValueError, BadCursorError) as e:
+            return error_response("400 Bad Request", "InvalidRequest", str(e))
+
+        response = {"feed": [{"post": post_uri} for post_uri in post_uris]}
+        if next_cursor is not None:
+            response["cursor"] = next_cursor
+
+        return json_response(response)
+
+# Responses ------------------------------------------------------------------
+
+def json_response(data: dict, status: str = "200 OK") -> tuple[str, bytes]:
+    return status, json.dumps(data).encode("utf-8")
+
+def error_response(
+        status: str,
+        error: str,
+        message: str) -> tuple[str, bytes]:
+    return json_response({"error": error, "message": message}, status)
+
+# Advance since --------------------------------------------------------------
+
+def advance_since(since: datetime, rows: list) -> datetime:
+
+    """
+    Move the time status changes are read from to the latest update seen.
+    Both times must be timestamps without a time zone, or the comparison
+    fails and the index stops moving forward.
+    """
+
+    if len(rows) == 0:
+        return since
+
+    updated_at = rows[-1]["updated_at"]
+    if (since.tzinfo is None) != (updated_at.tzinfo is None):
+        raise TypeError(
+            "Feed refresh times must all have a time zone or all be without")
+
+    return max(since, updated_at)
+
+# Refresh index --------------------------------------------------------------
+
+async def refresh_index(
+        feed_index: FeedIndex,
+        since: datetime,
+        refresh_interval: float = 1,
+        prune_interval: float = 60) -> None:
+
+    loop = asyncio.get_running_loop()
+    next_prune = loop.time() + prune_interval
+
+    while True:
+
+        await asyncio.sleep(refresh_interval)
+
+        # Apply status changes since the last refresh
+        try:
+            rows = await get_post_updates(since - REFRESH_OVERLAP)
+            feed_index.apply(rows)
+            since = advance_since(since, rows)
+        except Exception as e:
+            logger.error(f"Error in feed.refresh_index: {e}")
+
+        # Remove posts that have left the window
+        if loop.time() >= next_prune:
+            feed_index.prune(utc_now())
+            next_prune = loop.time() + prune_interval
+
+# Serve feed -----------------------------------------------------------------
+
+async def serve(
+        host: str = "127.0.0.1",
+        port: int = 8000,
+        window: timedelta = timedelta(hours=48),
+        min_score: float = 0,
+        lifecycle: int = 1,
+        logfile: str = get_log_path("feed.log")) -> None:
+
+    # Create startup timer
+    startup_timer = StartupTimer()
+
+    # Create logger
+    logging.basicConfig(
+        filename=logfile,
+        filemode="w",
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        level=logging.INFO)
+
+    logger.info("Feed starting")
+
+    # Create signal monitor
+    signal_monitor = SignalMonitor(
+        "Feed", 
+        logger, 
+        os.path.dirname(logfile))
+
+    # Open database connection pool
+    await db.open_pool(max_size=1)
+
+    # Load posts in the window into the index
+    feed_index = FeedIndex(window, min_score)
+    with startup_timer.phase("load index"):
+        rows, since = await get_recent_posts(utc_now() - window)
+        feed_index.apply(rows)
+
+    signal_monitor.add_probe("Index size", feed_index.__len__)
+
+    # Keep the index up to date
+    refresh_task = asyncio.create_task(refresh_index(feed_index, since))
+
+    # Create server
+    feed_server = FeedServer(
+        feed_index,
+        hostname=os.getenv("SF_FEED_HOSTNAME"),
+        feed_uri=os.getenv("SF_FEED_URI"))
+    server = await asyncio.start_server(
+        feed_server.handle_connection,
+        host=host,
+        port=port)
+
+    # Report running
+    startup_timer.report("Feed", logger)
+    print("Feed running")
+    logger.info(f"Feed running with {len(feed_index)} posts")
+
+    # Run until shutdown signal
+    while not signal_monitor.shutdown:
+        await asyncio.sleep(lifecycle)
+
+    # Shut down server
+    server.close()
+    refresh_task.cancel()
+    await db.close_pool()
+
+# Main -----------------------------------------------------------------------
+
+if __name__ == '__main__':
+    asyncio.run(serve(
+        host=os.getenv("SF_FEED_HOST", "127.0.0.1"),
+        port=int(os.getenv("SF_FEED_PORT", "8000")),
+        window=timedelta(hours=float(os.getenv("SF_FEED_WINDOW_HOURS", "48"))),
+        min_score=float(os.getenv("SF_FEED_MIN_SCORE", "0"))))
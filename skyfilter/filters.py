@@ -0,0 +1,243 @@
+"""Compile declarative filter rules into a predicate for firehose posts"""
+
+# Imports --------------------------------------------------------------------
+
+import json
+import logging
+import os
+import re
+
+from atproto import models
+from typing import Callable
+
+# Constants ------------------------------------------------------------------
+
+# Rules equivalent to the filters originally hard-coded in the stream: posts
+# must be in English, have some text, and have images attached
+DEFAULT_RULES: list[dict] = [
+    {"name": "english", "type": "languages", "include": ["en"]},
+    {"name": "has_text", "type": "text_length", "min": 1},
+    {"name": "has_images", "type": "media", "include": ["images"]},
+]
+
+# Map embed types to the media type names used in rules
+MEDIA_TYPES: dict[str, str] = {
+    models.ids.AppBskyEmbedImages: "images",
+    models.ids.AppBskyEmbedVideo: "video",
+    models.ids.AppBskyEmbedExternal: "external",
+}
+
+# Embed types that quote another record
+QUOTE_TYPES: set[str] = {
+    models.ids.AppBskyEmbedRecord,
+    models.ids.AppBskyEmbedRecordWithMedia,
+}
+
+# Record accessors -----------------------------------------------------------
+
+def get_media_type(record: models.AppBskyFeedPost.Record) -> str | None:
+    embed = record.embed
+    if embed is None:
+        return None
+    if embed.py_type == models.ids.AppBskyEmbedRecordWithMedia:
+        embed = embed.media
+    return MEDIA_TYPES.get(embed.py_type)
+
+def get_labels(record: models.AppBskyFeedPost.Record) -> set[str]:
+    labels = record.labels
+    if labels is None or not hasattr(labels, "values"):
+        return set()
+    return {label.val for label in labels.values}
+
+# Rule compilers -------------------------------------------------------------
+
+# Each compiler takes a rule definition and returns a check that takes a post
+# record and returns True if the record passes the rule
+
+def compile_languages_rule(rule: dict) -> Callable:
+
+    include = frozenset(rule.get("include", []))
+    exclude = frozenset(rule.get("exclude", []))
+
+    def check(record: models.AppBskyFeedPost.Record) -> bool:
+        langs = record.langs
+        if not langs:
+            return False
+        if include and include.isdisjoint(langs):
+            return False
+        if exclude and not exclude.isdisjoint(langs):
+            return False
+        return True
+
+    return check
+
+def compile_media_rule(rule: dict) -> Callable:
+
+    include = frozenset(rule.get("include", []))
+    exclude = frozenset(rule.get("exclude", []))
+
+    def check(record: models.AppBskyFeedPost.Record) -> bool:
+        media_type = get_media_type(record)
+        if include and media_type not in include:
+            return False
+        if exclude and media_type in exclude:
+            return False
+        return True
+
+    return check
+
+def compile_text_length_rule(rule: dict) -> Callable:
+
+    min_length = rule.get("min", 0)
+    max_length = rule.get("max")
+
+    def check(record: models.AppBskyFeedPost.Record) -> bool:
+        text_length = len(record.text or "")
+        if text_length < min_length:
+            return False
+        if max_length is not None and text_length > max_length:
+            return False
+        return True
+
+    return check
+
+def compile_text_regex_rule(rule: dict) -> Callable:
+
+    flags = re.IGNORECASE if rule.get("ignore_case", False) else 0
+    search = re.compile(rule["pattern"], flags).search
+    match = rule.get("match", True)
+
+    def check(record: models.AppBskyFeedPost.Record) -> bool:
+        return (search(record.text or "") is not None) == match
+
+    return check
+
+def compile_labels_rule(rule: dict) -> Callable:
+
+    include = frozenset(rule.get("include", []))
+    exclude = frozenset(rule.get("exclude", []))
+
+    def check(record: models.AppBskyFeedPost.Record) -> bool:
+        labels = get_labels(record)
+        if include and include.isdisjoint(labels):
+            return False
+        if exclude and not exclude.isdisjoint(labels):
+            return False
+        return True
+
+    return check
+
+def compile_reply_rule(rule: dict) -> Callable:
+
+    allow = rule.get("allow", True)
+
+    def check(record: models.AppBskyFeedPost.Record) -> bool:
+        return allow or record.reply is None
+
+    return check
+
+def compile_quote_rule(rule: dict) -> Callable:
+
+    allow = rule.get("allow", True)
+
+    def check(record: models.AppBskyFeedPost.Record) -> bool:
+        return allow or record.embed is None or \
+            record.embed.py_type not in QUOTE_TYPES
+
+    return check
+
+RULE_COMPILERS: dict[str, Callable[[dict], Callable]] = {
+    "languages": compile_languages_rule,
+    "media": compile_media_rule,
+    "text_length": compile_text_length_rule,
+    "text_regex": compile_text_regex_rule,
+    "labels": compile_labels_rule,
+    "reply": compile_reply_rule,
+    "quote": compile_quote_rule,
+}
+
+# Load rules -----------------------------------------------------------------
+
+def load_rules(rules_path: str | None = None) -> list[dict]:
+
+    """
+    Load filter rules from a JSON file. If no path is given the path is read
+    from SF_FILTER_RULES, and if that is not set the default rules are used.
+    """
+
+    if rules_path is None:
+        rules_path = os.getenv("SF_FILTER_RULES")
+
+    if not rules_path:
+        return DEFAULT_RULES
+
+    with open(rules_path) as f:
+        config = json.load(f)
+
+    # Accept either a list of rules or an object with a list of rules
+    if isinstance(config, dict):
+        config = config["rules"]
+
+    return config
+
+# Filter engine class --------------------------------------------------------
+
+class FilterEngine:
+
+    """
+    Compiles a list of rules into a single predicate and counts how many
+    records each rule accepts and rejects. Rules are applied in order and
+    the first rejection stops evaluation, so each rule only sees the records
+    accepted by the rules before it.
+    """
+
+    def __init__(self, rules: list[dict]) -> None:
+
+        self.names = []
+        checks = []
+
+        for rule in rules:
+            rule_type = rule.get("type")
+            if rule_type not in RULE_COMPILERS:
+                raise ValueError(f"Unknown filter rule type: {rule_type}")
+            self.names.append(rule.get("name", rule_type))
+            checks.append(RULE_COMPILERS[rule_type](rule))
+
+        self.accepted = [0] * len(checks)
+        self.rejected = [0] * len(checks)
+        self.predicate = self.compile(tuple(checks))
+
+    def __call__(self, record: models.AppBskyFeedPost.Record) -> bool:
+        return self.predicate(record)
+
+    def compile(self, checks: tuple) -> Callable:
+
+        accepted = self.accepted
+        rejected = self.rejected
+        indexed_checks = tuple(enumerate(checks))
+
+        def predicate(record: models.AppBskyFeedPost.Record) -> bool:
+            for i, check in indexed_checks:
+                if not check(record):
+                    rejected[i] += 1
+                    return False
+                accepted[i] += 1
+            return True
+
+        return predicate
+
+    def get_counts(self) -> list[dict]:
+        return [{
+            "name": name,
+            "accepted": self.accepted[i],
+            "rejected": self.rejected[i]
+        } for i, name in enumerate(self.names)]
+
+    def report(self, logger: logging.Logger) -> None:
+        for count in self.get_counts():
+            seen = count["accepted"] + count["rejected"]
+            rejected_pct = 100 * count["rejected"] / seen if seen else 0
+            logger.info(
+                f"Filter rule {count['name']}: "
+                f"{count['accepted']} accepted, "
+                f"{count['rejected']} rejected ({rejected_pct:.1f}%)")
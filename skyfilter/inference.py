@@ -0,0 +1,308 @@
+"""Serve image classification to processor workers over a Unix socket"""
+
+# Imports --------------------------------------------------------------------
+
+import asyncio
+import json
+import logging
+import os
+import struct
+
+from dotenv import load_dotenv
+from typing import TYPE_CHECKING
+
+from skyfilter.utils import get_log_path
+from skyfilter.utils import SignalMonitor
+from skyfilter.utils import StartupTimer
+
+# Models are only imported by the server so that clients do not import torch
+if TYPE_CHECKING:
+    from firekit.predict import Predictor
+
+# Setup ----------------------------------------------------------------------
+
+# Load environment variables
+load_dotenv()
+
+# Create logger
+logger = logging.getLogger(__name__)
+
+# Constants ------------------------------------------------------------------
+
+INFERENCE_SOCKET = os.path.join("models", "inference.sock")
+
+# Messages are JSON preceded by their length as a four byte unsigned integer
+HEADER = struct.Struct(">I")
+
+# Seconds a client waits for the server to score a request
+INFERENCE_TIMEOUT = 60
+
+# Exceptions -----------------------------------------------------------------
+
+class InferenceUnavailable(Exception):
+
+    """ The inference server could not be reached or did not respond. """
+
+# Messages -------------------------------------------------------------------
+
+async def read_message(reader: asyncio.StreamReader) -> dict:
+    header = await reader.readexactly(HEADER.size)
+    (length,) = HEADER.unpack(header)
+    body = await reader.readexactly(length)
+    return json.loads(body)
+
+async def write_message(writer: asyncio.StreamWriter, message: dict) -> None:
+    body = json.dumps(message).encode("utf-8")
+    writer.write(HEADER.pack(len(body)) + body)
+    await writer.drain()
+
+# Inference server class -----------------------------------------------------
+
+class InferenceServer:
+
+    """
+    Holds a single predictor and scores images for any number of connected
+    workers. Requests that arrive within max_wait seconds of each other are
+    combined into one batch of up to max_batch_size images. A request that
+    would take a batch past the limit is held over for the next batch, and a
+    request larger than the limit is scored as a batch on its own.
+    """
+
+    def __init__(
+            self,
+            predictor: "Predictor",
+            max_batch_size: int = 32,
+            max_wait: float = 0.01) -> None:
+        self.predictor = predictor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue()
+        self.held_request = None
+
+    async def handle_client(
+            self,
+            reader: asyncio.StreamReader,
+            writer: asyncio.StreamWriter) -> None:
+
+        try:
+            while True:
+                request = await read_message(reader)
+                future = asyncio.get_running_loop().create_future()
+                await self.queue.put((request["paths"], future))
+                try:
+                    response = {"scores": await future}
+                except Exception as e:
+                    response = {"error": str(e)}
+                await write_message(writer, response)
+
+        except asyncio.IncompleteReadError:
+            pass
+
+        except Exception as e:
+            logger.error(f"Error in inference.handle_client: {e}")
+
+        finally:
+            writer.close()
+
+    async def get_requests(self) -> list:
+
+        # Start with the request held over from the last batch, or wait for 
+        # the first request, then collect any that arrive shortly after it 
+        # until the next one would not fit
+        if self.held_request is not None:
+            requests = [self.held_request]
+            self.held_request = None
+        else:
+            requests = [await self.queue.get()]
+        batch_size = len(requests[0][0])
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+
+        while batch_size < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                request = await asyncio.wait_for(self.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if batch_size + len(request[0]) > self.max_batch_size:
+                self.held_request = request
+                break
+            requests.append(request)
+            batch_size += len(request[0])
+
+        return requests
+
+    async def run_batcher(self) -> None:
+
+        from skyfilter.models import predict_image_scores
+
+        loop = asyncio.get_running_loop()
+
+        while True:
+
+            requests = await self.get_requests()
+            paths = [path for request_paths, _ in requests
+                for path in request_paths]
+
+            try:
+
+                # Score the whole batch in a worker thread so the server can
+                # keep accepting requests while the model runs
+                scores = await loop.run_in_executor(
+                    None, predict_image_scores, self.predictor, paths)
+
+                start = 0
+                for request_paths, future in requests:
+                    end = start + len(request_paths)
+                    future.set_result(scores[start:end])
+                    start = end
+
+            except Exception:
+
+                # If the batch fails, score each request on its own so an
+                # unreadable image only fails the request it came from
+                for request_paths, future in requests:
+                    try:
+                        scores = await loop.run_in_executor(
+                            None,
+                            predict_image_scores,
+                            self.predictor,
+                            request_paths)
+                        future.set_result(scores)
+                    except Exception as e:
+                        logger.error(f"Error in inference.run_batcher: {e}")
+                        future.set_exception(e)
+
+# Inference client class -----------------------------------------------------
+
+class InferenceClient:
+
+    """ 
+    Requests image scores from an inference server. Raises 
+    InferenceUnavailable if the server cannot be reached or does not respond
+    within timeout seconds.
+    """
+
+    def __init__(
+            self, 
+            socket_path: str = INFERENCE_SOCKET,
+            timeout: float = INFERENCE_TIMEOUT) -> None:
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    async def check(self) -> bool:
+
+        # Check the server accepts connections
+        try:
+            _, writer = await asyncio.wait_for(
+                asyncio.open_unix_connection(self.socket_path), 
+                self.timeout)
+            writer.close()
+            return True
+        except (OSError, asyncio.TimeoutError) as e:
+            logger.error(f"Error in inference.check: {e}")
+            return False
+
+    async def request(self, image_paths: list) -> dict:
+
+        # Open a connection per request so that concurrent requests from the
+        # same worker can be batched together by the server
+        reader, writer = await asyncio.open_unix_connection(self.socket_path)
+
+        try:
+            await write_message(writer, {
+                "paths": [os.path.abspath(path) for path in image_paths]})
+            return await read_message(reader)
+        finally:
+            writer.close()
+
+    async def predict(self, image_paths: list) -> list:
+
+        try:
+            response = await asyncio.wait_for(
+                self.request(image_paths), 
+                self.timeout)
+        except (
+                OSError, 
+                asyncio.IncompleteReadError, 
+                asyncio.TimeoutError) as e:
+            raise InferenceUnavailable(
+                f"Inference server unavailable: {e!r}") from e
+
+        if "error" in response:
+            raise Exception(response["error"])
+
+        return response["scores"]
+
+# Serve ----------------------------------------------------------------------
+
+async def serve(
+        socket_path: str = INFERENCE_SOCKET,
+        lifecycle: int = 1,
+        logfile: str = get_log_path("inference.log")) -> None:
+
+    # Create startup timer
+    startup_timer = StartupTimer()
+
+    # Create logger
+    logging.basicConfig(
+        filename=logfile,
+        filemode="w",
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        level=logging.INFO)
+
+    logger.info("Inference server starting")
+
+    # Create predictor
+    with startup_timer.phase("imports"):
+        from skyfilter.models import load_predictor
+        from skyfilter.models import warm_up
+
+    with startup_timer.phase("model"):
+        predictor = load_predictor()
+
+    with startup_timer.phase("warm up"):
+        warm_up(predictor)
+
+    # Create signal monitor
+    signal_monitor = SignalMonitor(
+        "Inference server", 
+        logger, 
+        os.path.dirname(logfile))
+
+    # Create server
+    inference_server = InferenceServer(predictor)
+    batcher_task = asyncio.create_task(inference_server.run_batcher())
+
+    # Report queued requests when state is dumped
+    signal_monitor.add_probe("Queue depth", inference_server.queue.qsize)
+
+    # Remove a socket left behind by a previous server
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    server = await asyncio.start_unix_server(
+        inference_server.handle_client,
+        path=socket_path)
+
+    # Report running
+    startup_timer.report("Inference server", logger)
+    print("Inference server running")
+    logger.info("Inference server running")
+
+    # Run until shutdown signal
+    while not signal_monitor.shutdown:
+        await asyncio.sleep(lifecycle)
+
+    # Shut down server
+    server.close()
+    await server.wait_closed()
+    batcher_task.cancel()
+    os.remove(socket_path)
+
+# Main -----------------------------------------------------------------------
+
+if __name__ == '__main__':
+    asyncio.run(serve(os.getenv("SF_INFERENCE_SOCKET", INFERENCE_SOCKET)))
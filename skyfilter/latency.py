@@ -0,0 +1,103 @@
+"""Report latency percentiles for each stage of processing posts"""
+
+# Imports --------------------------------------------------------------------
+
+import argparse
+import asyncio
+
+from datetime import timedelta
+from dotenv import load_dotenv
+
+from skyfilter import database as db
+from skyfilter.utils import utc_now
+
+# Setup ----------------------------------------------------------------------
+
+# Load environment variables
+load_dotenv()
+
+# Constants ------------------------------------------------------------------
+
+# Each stage is measured from the first timestamp column to the second. In
+# thumbnail first mode, full size images are downloaded after classifying
+# kept posts, so persisting starts when the full size download ends
+STAGES: list[tuple[str, str, str]] = [
+    ("firehose", "post_created_at", "received_at"),
+    ("recorded", "received_at", "recorded_at"),
+    ("claimed", "recorded_at", "claimed_at"),
+    ("hydrated", "claimed_at", "hydrated_at"),
+    ("downloaded", "hydrated_at", "downloaded_at"),
+    ("classified", "downloaded_at", "classified_at"),
+    ("fullsize downloaded", "classified_at", "fullsize_downloaded_at"),
+    ("persisted", 
+        "COALESCE(fullsize_downloaded_at, classified_at)", 
+        "persisted_at"),
+    ("received to classified", "received_at", "classified_at"),
+    ("received to persisted", "received_at", "persisted_at"),
+]
+
+PERCENTILES: list[float] = [0.5, 0.95, 0.99]
+
+# Get stage latencies --------------------------------------------------------
+
+async def get_stage_latencies(window: timedelta) -> list:
+
+    # Build one count and one set of percentiles for each stage
+    columns = []
+    for i, (_, start, end) in enumerate(STAGES):
+        seconds = f"EXTRACT(EPOCH FROM ({end} - {start}))"
+        columns.append(f"count({seconds}) AS count_{i}")
+        columns.append(
+            f"percentile_cont(%(percentiles)s) "
+            f"WITHIN GROUP (ORDER BY {seconds}) AS percentiles_{i}")
+
+    sql = f"""
+        SELECT {", ".join(columns)}
+        FROM posts
+        WHERE persisted_at >= %(since)s;
+        """
+
+    params = {"percentiles": PERCENTILES, "since": utc_now() - window}
+    rows = await db.fetch_all(sql, params)
+    row = rows[0]
+
+    return [{
+        "stage": stage,
+        "count": row[f"count_{i}"],
+        "percentiles": row[f"percentiles_{i}"] or [None] * len(PERCENTILES)
+    } for i, (stage, _, _) in enumerate(STAGES)]
+
+# Print report ---------------------------------------------------------------
+
+def print_report(latencies: list, window: timedelta) -> None:
+
+    print(f"Stage latency in seconds for posts persisted in the last {window}")
+
+    headers = [f"p{round(p * 100)}" for p in PERCENTILES]
+    print(
+        f"{'stage':<24}{'count':>12}" + 
+        "".join(f"{header:>12}" for header in headers))
+
+    for latency in latencies:
+        values = "".join(
+            f"{'-':>12}" if value is None else f"{value:>12.3f}"
+            for value in latency["percentiles"])
+        print(f"{latency['stage']:<24}{latency['count']:>12}{values}")
+
+# Main -----------------------------------------------------------------------
+
+async def main(window: timedelta) -> None:
+    await db.open_pool(max_size=1)
+    latencies = await get_stage_latencies(window)
+    await db.close_pool()
+    print_report(latencies, window)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--minutes",
+        type=int,
+        default=60,
+        help="report on posts persisted in this many minutes")
+    args = parser.parse_args()
+    asyncio.run(main(timedelta(minutes=args.minutes)))
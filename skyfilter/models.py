@@ -2,6 +2,7 @@
 
 # Imports ---------------------------------------------------------------------
 
+import math
 import os
 import pandas as pd
 import torch
@@ -9,16 +10,21 @@ import torch.nn as nn
 import torch.nn.functional as F
 
 from firekit.predict import Predictor
+from firekit.utils import sigmoid
 from firekit.vision import ImagePathDataset
+from firekit.vision.imagedatasets import ImageReadError
 from firekit.vision.transforms import SquarePad
+from PIL import Image
 from torch import Tensor
 from torchvision.transforms import Compose
 from torchvision.transforms import Normalize
 from torchvision.transforms import Resize
+from torchvision.transforms.functional import pil_to_tensor
 
 # Constants ------------------------------------------------------------------
 
 MODEL_PATH = os.path.join("models", "visnet-5.1.pt")
+IMAGE_SIZE = 512
 
 # Model class ----------------------------------------------------------------
 
@@ -114,34 +120,150 @@ def load_predictor(
         model_path: str = MODEL_PATH,
         device: str = "cpu") -> Predictor:
     
-    """ Load the model as a predictor. """
+    """ 
+    Load the model as a predictor. The weights are memory-mapped rather than 
+    read into memory, so processes that load the same model file share its 
+    pages, and the model is built on the meta device so its parameters are 
+    not randomly initialised before being replaced by the weights.
+    """
 
     # Load model
     state_dict = torch.load(
         model_path, 
-        map_location=torch.device("cpu"))
-    model = VisNet()
-    model.load_state_dict(state_dict)
+        map_location=torch.device("cpu"),
+        mmap=True,
+        weights_only=True)
+    with torch.device("meta"):
+        model = VisNet()
+    model.load_state_dict(state_dict, assign=True)
 
     # Create and return predictor
     predictor = Predictor(model, device=device)
     return predictor
 
+# Warm up predictor ----------------------------------------------------------
+
+def warm_up(predictor: Predictor, batch_size: int = 1) -> None:
+
+    """ 
+    Run a forward pass on a blank batch so that the weights are paged in and
+    the first real batch does not pay for kernel and allocator setup.
+    """
+
+    x = torch.zeros(
+        (batch_size, 3, IMAGE_SIZE, IMAGE_SIZE), 
+        device=predictor.device)
+    with torch.no_grad():
+        predictor.model(x)
+
 # Get image transform for prediction -----------------------------------------
 
 def get_predict_transform():
     return Compose([
         SquarePad(),
-        Resize((512, 512)),
+        Resize((IMAGE_SIZE, IMAGE_SIZE)),
         Normalize(
             mean=[0.485, 0.456, 0.406],
             std=[0.229, 0.224, 0.225])])
 
+# Read image at reduced resolution -------------------------------------------
+
+def read_image_draft(image_path: str, size: int = IMAGE_SIZE) -> Tensor:
+
+    """ 
+    Read an image as an RGB tensor, letting the decoder downscale it while 
+    decoding so its longest side is as close to size as possible without 
+    going below it. JPEGs are scaled by 1/2, 1/4 or 1/8 in the DCT, other 
+    formats are decoded at full size. 
+    """
+
+    with Image.open(image_path) as image:
+        width, height = image.size
+        scale = size / max(width, height)
+        if scale < 1:
+            image.draft("RGB", (
+                math.ceil(width * scale), 
+                math.ceil(height * scale)))
+        image_tensor = pil_to_tensor(image.convert("RGB"))
+
+    return image_tensor.type(torch.float32)
+
+# Reduced resolution image dataset class -------------------------------------
+
+class DraftImagePathDataset(ImagePathDataset):
+
+    """ 
+    An ImagePathDataset that reads images at reduced resolution with 
+    read_image_draft. Images are read as RGB. 
+    """
+
+    def __init__(
+            self, 
+            data: pd.DataFrame, 
+            size: int = IMAGE_SIZE,
+            transform=None, 
+            target_transform=None) -> None:
+        super().__init__(
+            data, 
+            read_mode="RGB", 
+            transform=transform, 
+            target_transform=target_transform)
+        self.size = size
+
+    def __getitem__(self, idx: int) -> tuple:
+
+        try:
+
+            image_path = self.data[idx, 0]
+            image = read_image_draft(image_path, self.size)
+            labels = self.get_labels(idx)
+
+            if self.transform:
+                image = self.transform(image)
+
+            if self.target_transform:
+                labels = self.target_transform(labels)
+
+            return image, labels
+
+        except Exception as error:
+            msg = f"Error reading {image_path}: {error}"
+            raise ImageReadError(msg)
+
 # Load images as dataset -----------------------------------------------------
 
-def get_image_dataset(image_paths: list) -> ImagePathDataset:
+def get_image_dataset(
+        image_paths: list,
+        draft: bool = True) -> ImagePathDataset:
+
+    """ 
+    Load images as a dataset. By default images are decoded at reduced 
+    resolution, set draft to False to decode them at full resolution. 
+    """
+
+    data = pd.DataFrame({"path": image_paths, "label": -1})
+
+    if draft:
+        return DraftImagePathDataset(
+            data, 
+            transform=get_predict_transform())
+
     image_dataset = ImagePathDataset(
-        pd.DataFrame({"path": image_paths, "label": -1}),
+        data,
         read_mode="RGB",
         transform=get_predict_transform())
     return image_dataset
+
+# Predict image scores -------------------------------------------------------
+
+def predict_image_scores(
+        predictor: Predictor, 
+        image_paths: list,
+        draft: bool = True) -> list:
+
+    """ Predict the probability score for each image in a list of paths. """
+
+    image_dataset = get_image_dataset(image_paths, draft)
+    predictions = predictor.predict(image_dataset, batch_size=len(image_paths))
+    probabilities = sigmoid(predictions)
+    return [float(probability[0]) for probability in probabilities]
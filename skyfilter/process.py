@@ -6,23 +6,32 @@ import asyncio
 import logging
 import requests
 import numpy as np
-import time
 import os
 import psycopg
+import time
 
 from atproto import AsyncClient
-from firekit.predict import Predictor
-from firekit.utils import sigmoid
 from datetime import date
 from datetime import datetime
+from datetime import timedelta
 from dotenv import load_dotenv
-from psycopg.rows import dict_row
+from psycopg import AsyncConnection
+from typing import TYPE_CHECKING
 
 from skyfilter import database as db
-from skyfilter.models import load_predictor
-from skyfilter.models import get_image_dataset
+from skyfilter.inference import InferenceClient
+from skyfilter.inference import InferenceUnavailable
+from skyfilter.utils import get_log_path
 from skyfilter.utils import nested_key_exists
 from skyfilter.utils import SignalMonitor
+from skyfilter.utils import StartupTimer
+from skyfilter.utils import ThroughputCounter
+from skyfilter.utils import utc_now
+
+# Models are imported when the predictor is loaded so that torch and the rest
+# of the model stack are not imported before the process starts up
+if TYPE_CHECKING:
+    from firekit.predict import Predictor
 
 # Setup ----------------------------------------------------------------------
 
@@ -35,10 +44,23 @@ logger = logging.getLogger(__name__)
 # Create RNG
 RNG = np.random.default_rng()
 
+# Constants ------------------------------------------------------------------
+
+# Posts whose highest image score is below the threshold are dropped at random
+# at the given rate
+DROP_THRESHOLD = 0.2
+DROP_RATE = 0.9
+
+# Posts claimed by a processor that has not saved them after this long can 
+# be claimed again
+CLAIM_TIMEOUT = timedelta(minutes=10)
+
 # Get a client ---------------------------------------------------------------
 
 async def get_client() -> AsyncClient:
-    client = AsyncClient()
+
+    # Use the Bluesky API unless another service is set
+    client = AsyncClient(base_url=os.getenv("SF_BSKY_BASE_URL"))
     await client.login(
         os.getenv("SF_BSKY_USER"), 
         os.getenv("SF_BSKY_PASS"))
@@ -104,7 +126,9 @@ def get_post_images(post: dict) -> list:
 
 # Get image filepath from url ------------------------------------------------
 
-def get_image_download_path(image_url: str) -> str:
+def get_image_download_path(
+        image_url: str,
+        thumbnail: bool = False) -> str:
 
     # Get image suffix
     image_suffix = image_url.split("@")[-1]
@@ -113,18 +137,22 @@ def get_image_download_path(image_url: str) -> str:
     image_name = image_url.split("/")[-1]
     image_name = image_name.split("@")[0]
 
+    # Thumbnails have the same name as the full size image so tag them
+    if thumbnail:
+        image_name = f"{image_name}-thumb"
+
     # Construct filename
     image_filename = f"{image_name}.{image_suffix}"
    
-    # Extract filepath components
-    filepath_dirs = str(os.getenv("SF_DB_IMAGES_DIR")).split("/")
+    # Get images directory, which may be absolute
+    images_dir = os.path.normpath(str(os.getenv("SF_DB_IMAGES_DIR")))
 
     # Get date directory (and create the directory if it doesn't exist)
     date_dir = date.today().isoformat()
-    os.makedirs(os.path.join(*filepath_dirs, date_dir), exist_ok=True)
+    os.makedirs(os.path.join(images_dir, date_dir), exist_ok=True)
 
     # Combine components with name
-    image_filepath = os.path.join(*filepath_dirs, date_dir, image_filename)
+    image_filepath = os.path.join(images_dir, date_dir, image_filename)
     return image_filepath
 
 # Delete images --------------------------------------------------------------
@@ -140,11 +168,15 @@ def delete_images(images: list) -> list:
 
 # Fetch post image -----------------------------------------------------------
 
-async def fetch_image(post_image: dict) -> dict:
+async def fetch_image(
+        post_image: dict,
+        size: str = "fullsize") -> dict:
     
     # Get image locations
-    image_url = post_image["fullsize"]
-    image_filepath = get_image_download_path(image_url)
+    image_url = post_image[size]
+    image_filepath = get_image_download_path(
+        image_url, 
+        thumbnail=(size == "thumb"))
 
     # Get image params
     height = None
@@ -185,11 +217,13 @@ async def fetch_image(post_image: dict) -> dict:
 
 # Fetch post images ----------------------------------------------------------
 
-async def fetch_images(post_images: list) -> list:
+async def fetch_images(
+        post_images: list,
+        size: str = "fullsize") -> list:
 
     # Fetch images asynchronously
     images = await asyncio.gather(
-        *(fetch_image(post_image) for post_image in post_images))
+        *(fetch_image(post_image, size) for post_image in post_images))
     
     # Check if all images were fetched
     fetch_errors = False
@@ -203,17 +237,45 @@ async def fetch_images(post_images: list) -> list:
          
     return images
 
+# Fetch full size images for thumbnails -------------------------------------
+
+async def fetch_fullsize_images(
+        post_images: list,
+        thumbnail_images: list) -> list:
+
+    # Fetch the full size images and give them the thumbnail scores
+    images = await fetch_images(post_images, "fullsize")
+    for image, thumbnail_image in zip(images, thumbnail_images):
+        image["score"] = thumbnail_image["score"]
+
+    # Delete the thumbnails, which are no longer needed
+    delete_images(thumbnail_images)
+
+    return images
+
 # Classify images ------------------------------------------------------------
 
-def classify_images(predictor: Predictor, images: list) -> list:
+async def classify_images(
+        predictor: "Predictor | InferenceClient",
+        images: list) -> list:
 
     try:
         image_paths = [image["filepath"] for image in images]
-        image_dataset = get_image_dataset(image_paths)
-        predictions = predictor.predict(image_dataset, batch_size=len(images))
-        probabilities = sigmoid(predictions)
+
+        # Use the inference server in client mode, otherwise the local model
+        if isinstance(predictor, InferenceClient):
+            scores = await predictor.predict(image_paths)
+        else:
+            from skyfilter.models import predict_image_scores
+            scores = predict_image_scores(predictor, image_paths)
+
         for i in range(len(images)):
-            images[i]["score"] = np.float64(probabilities[i][0])
+            images[i]["score"] = np.float64(scores[i])
+
+    # The post can be processed again once the inference server is back
+    except InferenceUnavailable:
+        delete_images(images)
+        raise
 
     except Exception as e:
         logger.error(f"Error in process.classify_images: {e}")
@@ -228,7 +290,7 @@ def drop_random_negatives(images: list) -> bool:
     # Randomly drop negative results below threshold
     drop = False
     highest_score = np.max([image["score"] for image in images])
-    if highest_score < 0.2 and RNG.random() < 0.9:
+    if highest_score < DROP_THRESHOLD and RNG.random() < DROP_RATE:
         delete_images(images)
         drop = True
 
@@ -238,19 +300,22 @@ def drop_random_negatives(images: list) -> bool:
 
 async def process_post(
         client: AsyncClient,
-        predictor: Predictor,
+        predictor: "Predictor | InferenceClient",
         post_id: int,
-        post_uri: str) -> dict:
+        post_uri: str,
+        thumbnail_first: bool = False) -> dict:
     
     # Initialise uncatalogued result
     result = { 
         "status_id": db.POST_STATUS_UNCATALOGUED,
         "post_id": post_id,
-        "post_uri": post_uri 
+        "post_uri": post_uri,
+        "stages": {}
     }
 
     # If post is on block list, return blocked
     post = await fetch_post(client, post_uri)
+    result["stages"]["hydrated"] = utc_now()
 
     # Post is on block list
     if block_post(post) == True:
@@ -265,8 +330,11 @@ async def process_post(
         result["status_id"] = db.POST_STATUS_FETCH_POST_ERROR
         return result
     
-    # Fetch images
-    images = await fetch_images(post_images)
+    # Fetch images, or their thumbnails in thumbnail first mode
+    images = await fetch_images(
+        post_images, 
+        "thumb" if thumbnail_first else "fullsize")
+    result["stages"]["downloaded"] = utc_now()
 
     # If fetch errors, return fetch image error
     if len(images) == 0:
@@ -274,7 +342,8 @@ async def process_post(
         return result
      
     # Classify images
-    classified_images = classify_images(predictor, images)
+    classified_images = await classify_images(predictor, images)
+    result["stages"]["classified"] = utc_now()
 
     # If classify errors, return classify image error
     if len(classified_images) == 0:
@@ -289,6 +358,18 @@ async def process_post(
         result["status_id"] = db.POST_STATUS_DROPPED
         return result
 
+    # In thumbnail first mode, fetch full size images for kept posts
+    if thumbnail_first:
+        classified_images = await fetch_fullsize_images(
+            post_images, 
+            classified_images)
+        result["stages"]["fullsize_downloaded"] = utc_now()
+
+        # If fetch errors, return fetch image error
+        if len(classified_images) == 0:
+            result["status_id"] = db.POST_STATUS_FETCH_IMAGE_ERROR
+            return result
+
     # Update result
     result["status_id"] = db.POST_STATUS_COMPLETE
     result["images"] = classified_images
@@ -297,102 +378,343 @@ async def process_post(
 
 # Get batch ------------------------------------------------------------------
 
-def get_batch(batch_size: int) -> list:
+async def get_batch(batch_size: int) -> list:
     result = []
-    dsn = db.get_connection_string()
-    with psycopg.connect(dsn) as conn:
-        with conn.cursor(row_factory=dict_row) as cur:
+    try:
+
+        # Claim the oldest uncatalogued posts, and posts whose claim has 
+        # expired, by marking them in progress. Posts being claimed by 
+        # another processor are skipped, so each post is claimed once
+        sql = """
+            UPDATE posts 
+            SET 
+                post_status_id = (%s),
+                claimed_at = (%s),
+                updated_at = now()
+            WHERE post_id IN (
+                SELECT post_id 
+                FROM posts 
+                WHERE 
+                    post_status_id = (%s) OR 
+                    (post_status_id = (%s) AND claimed_at < (%s))
+                ORDER BY post_created_at 
+                LIMIT (%s)
+                FOR UPDATE SKIP LOCKED)
+            RETURNING 
+                post_id, 
+                post_uri,
+                claimed_at;
+            """
+        claimed_at = utc_now()
+        params = (
+            db.POST_STATUS_IN_PROGRESS,
+            claimed_at,
+            db.POST_STATUS_UNCATALOGUED,
+            db.POST_STATUS_IN_PROGRESS,
+            claimed_at - CLAIM_TIMEOUT,
+            batch_size)
+        result = await db.fetch_all(sql, params)
+    except Exception as e:
+        logger.error(f"Error in process.get_batch: {e}")
+    return result
+
+# Release batch --------------------------------------------------------------
+
+async def release_batch(posts: list) -> None:
+
+    # Return claimed posts that will not be processed to uncatalogued
+    try:
+        sql = """
+            UPDATE posts 
+            SET 
+                post_status_id = (%s),
+                claimed_at = NULL,
+                updated_at = now()
+            WHERE 
+                post_id = ANY(%s) AND 
+                post_status_id = (%s);
+            """
+        params = (
+            db.POST_STATUS_UNCATALOGUED,
+            [post["post_id"] for post in posts],
+            db.POST_STATUS_IN_PROGRESS)
+        await db.execute(sql, params)
+    except Exception as e:
+        logger.error(f"Error in process.release_batch: {e}")
+
+# Update posts ---------------------------------------------------------------
+
+async def update_posts(conn: AsyncConnection, results: list) -> set:
+
+    # Save the status and stage timestamps of every post in one statement and
+    # return the IDs of the posts updated. Posts are only updated while they
+    # are still in progress under this claim, so posts deleted while they 
+    # were being processed, or claimed again after the claim expired, keep 
+    # their status. The time the posts are persisted is set by the database
+    # when the update runs, in UTC without a time zone
+    values = ", ".join(
+        ["(%s::int, %s::int, %s::timestamp, %s::timestamp, "
+            "%s::timestamp, %s::timestamp, %s::timestamp)"] * len(results))
+
+    sql = f"""
+        UPDATE posts 
+        SET 
+            post_status_id = results.status_id,
+            hydrated_at = results.hydrated_at,
+            downloaded_at = results.downloaded_at,
+            classified_at = results.classified_at,
+            fullsize_downloaded_at = results.fullsize_downloaded_at,
+            persisted_at = clock_timestamp() AT TIME ZONE 'UTC',
+            updated_at = now()
+        FROM (VALUES {values}) AS results (
+            post_id,
+            status_id,
+            claimed_at,
+            hydrated_at,
+            downloaded_at,
+            classified_at,
+            fullsize_downloaded_at)
+        WHERE 
+            posts.post_id = results.post_id AND 
+            posts.post_status_id = (%s) AND
+            posts.claimed_at = results.claimed_at
+        RETURNING posts.post_id;
+        """
+
+    params = []
+    for result in results:
+        stages = result["stages"]
+        params += [
+            result["post_id"],
+            result["status_id"],
+            stages.get("claimed"),
+            stages.get("hydrated"),
+            stages.get("downloaded"),
+            stages.get("classified"),
+            stages.get("fullsize_downloaded")]
+    params.append(db.POST_STATUS_IN_PROGRESS)
+
+    cur = await conn.execute(sql, params)
+    return {row[0] for row in await cur.fetchall()}
+
+# Insert images --------------------------------------------------------------
+
+async def insert_images(conn: AsyncConnection, results: list) -> int:
+
+    # Insert the images of every post with one pipelined statement
+    sql = """
+        INSERT INTO images (
+            image_url,
+            image_filepath,
+            image_alt,
+            image_height,
+            image_width,
+            image_score,
+            post_id) 
+        VALUES (%s, %s, %s, %s, %s, %s, %s);
+        """
+
+    params = [(
+        image["url"],
+        image["filepath"],
+        image["alt"],
+        image["height"],
+        image["width"],
+        image["score"],
+        result["post_id"]) for result in results for image in result["images"]]
+
+    if len(params) > 0:
+        async with conn.cursor() as cur:
+            await cur.executemany(sql, params)
+
+    return len(params)
+
+# Persist results ------------------------------------------------------------
+
+async def persist_results(
+        conn: AsyncConnection,
+        results: list) -> tuple[int, int, list]:
+
+    # Update the posts, then save the images of the complete posts updated
+    post_ids = await update_posts(conn, results)
+    images = await insert_images(conn, [
+        result for result in results 
+        if result["post_id"] in post_ids and 
+            result["status_id"] == db.POST_STATUS_COMPLETE])
+
+    # Return the counts saved and the results of posts that were not updated
+    skipped = [
+        result for result in results if result["post_id"] not in post_ids]
+    return len(post_ids), images, skipped
+
+# Get deleted results --------------------------------------------------------
+
+async def get_deleted_results(results: list) -> list:
+
+    """
+    Get the results of posts that were deleted while the processor held 
+    their claim. A post claimed again by another processor downloads its 
+    images to the same files, so its images must be kept.
+    """
+
+    if len(results) == 0:
+        return []
+
+    deleted = []
+    try:
+        sql = """
+            SELECT post_id, claimed_at
+            FROM posts 
+            WHERE 
+                post_id = ANY(%s) AND 
+                post_status_id = (%s);
+            """
+        params = (
+            [result["post_id"] for result in results],
+            db.POST_STATUS_DELETED)
+        rows = await db.fetch_all(sql, params)
+        claims = {row["post_id"]: row["claimed_at"] for row in rows}
+        deleted = [
+            result for result in results 
+            if result["post_id"] in claims and 
+                claims[result["post_id"]] == result["stages"].get("claimed")]
+    except Exception as e:
+        logger.error(f"Error in process.get_deleted_results: {e}")
+    return deleted
+
+# Save results ---------------------------------------------------------------
+
+async def save_results(results: list) -> tuple[int, int]:
+
+    """
+    Save a batch of results with one update for the posts and one insert for
+    the images. If the batch fails, each result is saved in its own
+    transaction so one bad result does not stop the others being saved. 
+    Results are not saved again if the connection fails.
+    """
+
+    async def work(conn: AsyncConnection) -> tuple[int, int, list]:
+
+        try:
+            async with conn.transaction():
+                return await persist_results(conn, results)
+        except psycopg.OperationalError:
+            raise
+        except Exception as e:
+            logger.error(f"Error in process.save_results: {e}")
+
+        posts, images, skipped = 0, 0, []
+        for result in results:
             try:
-                sql = """
-                    SELECT 
-                        post_id, 
-                        post_uri
-                    FROM posts 
-                    WHERE post_status_id = 1 
-                    ORDER BY post_created_at 
-                    LIMIT (%s);
-                    """
-                cur.execute(sql, (batch_size,))
-                result = cur.fetchall()
+                async with conn.transaction():
+                    result_posts, result_images, result_skipped = \
+                        await persist_results(conn, [result])
+                posts += result_posts
+                images += result_images
+                skipped += result_skipped
+            except psycopg.OperationalError:
+                raise
             except Exception as e:
-                logger.error(f"Error in process.get_batch: {e}")
-    return result
+                logger.error(
+                    f"Error in process.save_results: "
+                    f"post {result['post_id']}: {e}")
+
+        return posts, images, skipped
+
+    if len(results) == 0:
+        return 0, 0
+
+    # Do not retry on a new connection, as some results may already have 
+    # been committed when the connection failed
+    posts, images, skipped = await db.run_transaction(work, retries=0)
+
+    # Delete the images of posts that were not updated once the rest are 
+    # saved, if they were deleted while they were being processed
+    deleted = await get_deleted_results([
+        result for result in skipped 
+        if result["status_id"] == db.POST_STATUS_COMPLETE])
+    for result in deleted:
+        delete_images(result["images"])
+
+    return posts, images
 
 # Process batch --------------------------------------------------------------
 
 async def process_batch(
         client: AsyncClient, 
-        predictor: Predictor,
-        posts: list) -> list:
+        predictor: "Predictor | InferenceClient",
+        posts: list,
+        thumbnail_first: bool = False,
+        persist_counter: ThroughputCounter | None = None) -> list:
 
     # Create a generator of posts to process
     posts_generator = (process_post(
         client, 
         predictor,
         post["post_id"], 
-        post["post_uri"]) for post in posts)
+        post["post_uri"],
+        thumbnail_first) for post in posts)
     
     # Run the generator on each post asynchronously
-    results = await asyncio.gather(*posts_generator)
-
-    # Save the results to the database
-    dsn = db.get_connection_string()
-    with psycopg.connect(dsn) as conn:
-        with conn.cursor() as cur:
-            for result in results:
-                try:
-                    
-                    sql = """
-                        UPDATE posts 
-                        SET post_status_id = (%s)
-                        WHERE post_id = (%s);
-                        """
-
-                    params = (result["status_id"], result["post_id"])
-                    cur.execute(sql, params)
-
-                    if result["status_id"] == db.POST_STATUS_COMPLETE:
-                        
-                        for image in result["images"]:
-
-                            sql = """
-                                INSERT INTO images (
-                                image_url,
-                                image_filepath,
-                                image_alt,
-                                image_height,
-                                image_width,
-                                image_score,
-                                post_id) 
-                            VALUES (%s, %s, %s, %s, %s, %s, %s);
-                            """
-
-                            params = (
-                                image["url"],
-                                image["filepath"],
-                                image["alt"],
-                                image["height"],
-                                image["width"],
-                                image["score"],
-                                result["post_id"])
-                            
-                            cur.execute(sql, params)
-
-                    conn.commit()
-
-                except Exception as e:
-                    logger.error(f"Error in process.process_batch: {e}")
-                    conn.rollback()
+    outcomes = await asyncio.gather(*posts_generator, return_exceptions=True)
+
+    # Release posts that could not be processed, such as posts classified 
+    # while the inference server was unavailable, so they can be claimed 
+    # again, and add the time each other post was claimed to its stages
+    results = []
+    failed_posts = []
+    for post, outcome in zip(posts, outcomes):
+        if isinstance(outcome, Exception):
+            logger.error(
+                f"Error in process.process_batch: "
+                f"post {post['post_id']}: {outcome}")
+            failed_posts.append(post)
+            continue
+        outcome["stages"]["claimed"] = post.get("claimed_at")
+        results.append(outcome)
+
+    if len(failed_posts) > 0:
+        await release_batch(failed_posts)
+
+    # Save the results to the database and count the posts and images saved
+    try:
+        start = time.perf_counter()
+        saved_posts, saved_images = await save_results(results)
+        if persist_counter is not None and len(results) > 0:
+            persist_counter.add(
+                time.perf_counter() - start,
+                posts=saved_posts,
+                images=saved_images)
+    except Exception as e:
+        logger.error(f"Error in process.process_batch: {e}")
 
     return results
 
+# Prepare predictor ----------------------------------------------------------
+
+def prepare_predictor(startup_timer: StartupTimer) -> "Predictor":
+
+    # Import the model stack, load the model and warm it up
+    with startup_timer.phase("imports"):
+        from skyfilter.models import load_predictor
+        from skyfilter.models import warm_up
+
+    with startup_timer.phase("model"):
+        predictor = load_predictor()
+
+    with startup_timer.phase("warm up"):
+        warm_up(predictor)
+
+    return predictor
+
 # Process --------------------------------------------------------------------
 
 async def process(
-        logfile: str = os.path.join("logs", "process.log")) -> None:
+        report_interval: int = 300,
+        logfile: str = get_log_path("process.log")) -> None:
 
-    # Create predictor
-    predictor = load_predictor()
+    # Create startup timer
+    startup_timer = StartupTimer()
 
     # Create logger
     logging.basicConfig(
@@ -404,10 +726,10 @@ async def process(
     logger.info("Process starting")
 
     # Create signal monitor
-    signal_monitor = SignalMonitor("Process", logger)
-
-    # Create client
-    client = await get_client()
+    signal_monitor = SignalMonitor(
+        "Process", 
+        logger, 
+        os.path.dirname(logfile))
 
     # Set batch processing parameters
     batch_interval = 0.5
@@ -415,9 +737,66 @@ async def process(
     batch_wait = 4
     batch_size = 10
 
+    # Classify thumbnails and only fetch full size images for kept posts
+    thumbnail_first = os.getenv("SF_THUMBNAIL_FIRST", "") == "1"
+
+    # Create a client for the inference server if one is set, otherwise 
+    # prepare the predictor in a worker thread so the model loads and warms 
+    # up while the connections open and the first batch is claimed
+    predictor_task = None
+    socket_path = os.getenv("SF_INFERENCE_SOCKET")
+    if socket_path:
+        predictor = InferenceClient(socket_path)
+        with startup_timer.phase("inference server"):
+            if not await predictor.check():
+                print("Process could not connect to the inference server")
+                return
+    else:
+        predictor_task = asyncio.create_task(
+            asyncio.to_thread(prepare_predictor, startup_timer))
+
+    # Open database connection pool
+    with startup_timer.phase("database"):
+        await db.open_pool()
+
+    # Create client
+    with startup_timer.phase("login"):
+        client = await get_client()
+
+    # Claim the first batch of uncatalogued posts
+    with startup_timer.phase("first claim"):
+        posts = await get_batch(batch_size)
+
+    # Report the posts being processed and the persist throughput when state
+    # is dumped
+    persist_counter = ThroughputCounter("Persist throughput")
+    signal_monitor.add_probe(
+        "In flight post IDs", 
+        lambda: [post["post_id"] for post in posts or []])
+    signal_monitor.add_probe(
+        "Persist throughput", 
+        persist_counter.get_counts)
+
+    # Wait for the predictor, and shut down if it could not be prepared
+    if predictor_task is not None:
+        try:
+            predictor = await predictor_task
+        except Exception as e:
+            logger.error(f"Error in process.process: {e}")
+            print("Process could not prepare the predictor")
+            await release_batch(posts)
+            await db.close_pool()
+            return
+
+    # Report startup times
+    startup_timer.report("Process", logger)
+
     # Set next update to a second before current time
     next_update = datetime.now().timestamp() - 1
 
+    # Set next throughput report
+    next_report = datetime.now().timestamp() + report_interval
+
     # Report running
     print("Process running")
     logger.info("Process running")
@@ -429,20 +808,43 @@ async def process(
         now = datetime.now().timestamp()
 
         if now < next_update:
-            time.sleep(batch_postpone)
+            await asyncio.sleep(batch_postpone)
             continue
         
         # Set the time for the next update
         next_update = now + batch_interval
 
-        # Get batch of uncatalogued posts
-        posts = get_batch(batch_size)
+        # Get batch of uncatalogued posts, unless one was claimed at startup,
+        # and wait if the inference server cannot be reached
+        if posts is None:
+            if (isinstance(predictor, InferenceClient) and 
+                    not await predictor.check()):
+                await asyncio.sleep(batch_wait)
+                continue
+            posts = await get_batch(batch_size)
 
         # Wait if no posts to process
         if len(posts) == 0:
-            time.sleep(batch_wait)
-
-        await process_batch(client, predictor, posts)
+            await asyncio.sleep(batch_wait)
+
+        await process_batch(
+            client, 
+            predictor, 
+            posts, 
+            thumbnail_first, 
+            persist_counter)
+        posts = None
+
+        # Report persist throughput periodically
+        if now >= next_report:
+            persist_counter.report(logger)
+            next_report = now + report_interval
+
+    # Close database connection pool
+    await db.close_pool()
+
+    # Report final persist throughput
+    persist_counter.report(logger)
 
 
 # Main -----------------------------------------------------------------------
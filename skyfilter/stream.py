@@ -5,19 +5,23 @@
 import asyncio
 import logging
 import os
-import psycopg
 
 from atproto import AsyncFirehoseSubscribeReposClient
 from atproto import parse_subscribe_repos_message
 from atproto import firehose_models as fm
 from atproto import models
+from datetime import datetime
 from dotenv import load_dotenv
 from typing import Callable
 from typing import Coroutine
 
 from skyfilter import database as db
+from skyfilter.filters import FilterEngine
+from skyfilter.filters import load_rules
 from skyfilter.operations import get_ops_by_type
+from skyfilter.utils import get_log_path
 from skyfilter.utils import SignalMonitor
+from skyfilter.utils import utc_now
 
 # Setup ----------------------------------------------------------------------
 
@@ -29,7 +33,10 @@ logger = logging.getLogger(__name__)
 
 # Message handler ------------------------------------------------------------
 
-def get_message_handler(queue: asyncio.Queue) -> \
+def get_message_handler(
+        queue: asyncio.Queue,
+        delete_queue: asyncio.Queue,
+        filter_engine: FilterEngine) -> \
         Callable[[fm.MessageFrame], Coroutine[None, None, None]]:
 
     async def message_handler(message: fm.MessageFrame) -> None:
@@ -53,88 +60,151 @@ def get_message_handler(queue: asyncio.Queue) -> \
             uri = post["uri"]
             record = post["record"]
 
-            # Process record if not empty        
-            if record is not None and record.model_dump is not None:
-
-                # Convert record to dictionary
-                record = record.model_dump()
-
-                # Impose filter rules
-                try:
-                    
-                    # Uncoment to drop raw records into log file
-                    # logger.info(record)
-
-                    # Check there is a field for languages
-                    if record["langs"] is None:
-                        return
-                    
-                    # Check English is a specified language
-                    if "en" not in record["langs"]:
-                        return
-                    
-                    # Check there is a field for text
-                    if record["text"] is None:
-                        return
-                    
-                    # Check text is not empty
-                    if len(record["text"]) == 0:
-                        return
-                    
-                    # Check there is a field for embedded data 
-                    if record["embed"] is None:
-                        return
-
-                    # Check the embedded data contains images
-                    if "images" not in record["embed"].keys() and \
-                            ("media" not in record["embed"].keys() or \
-                            "images" not in record["embed"]["media"].keys()):
-                        return
-                    
-                    # Add the message data to the queue
-                    await queue.put({
-                        "uri": uri,
-                        "record": record
-                    })
-                                
-                except Exception as e:
-                    logger.error(f"Error in stream.get_message_handler: {e}")
-
-        # Process each post in deleted: todo
+            # Skip empty records
+            if record is None:
+                continue
+
+            # Impose filter rules
+            try:
+
+                # Uncoment to drop raw records into log file
+                # logger.info(record)
+
+                # Check the record passes the filter rules
+                if not filter_engine(record):
+                    continue
+
+                # Add the message data to the queue
+                await queue.put({
+                    "uri": uri,
+                    "text": record.text,
+                    "created_at": record.created_at,
+                    "received_at": utc_now()
+                })
+
+            except Exception as e:
+                logger.error(f"Error in stream.get_message_handler: {e}")
+
+        # Add the URI of each post in deleted to the delete queue
+        for post in ops["posts"]["deleted"]:
+            await delete_queue.put(post["uri"])
 
     return message_handler
 
 # Message recorder -----------------------------------------------------------
 
 async def message_recorder(queue: asyncio.Queue) -> None:
-    dsn = db.get_connection_string()
-    with psycopg.connect(dsn) as conn:
-        with conn.cursor() as cur:
-            while True:
-                try:
-                    post = await queue.get()
-                    post_uri = post["uri"]
-                    post_text = post["record"]["text"]
-                    post_created_at = post["record"]["created_at"]
-                    sql = """
-                        INSERT INTO posts (
-                            post_uri, 
-                            post_text,
-                            post_created_at) 
-                        VALUES (%s, %s, %s);
-                        """
-                    cur.execute(sql, (post_uri, post_text, post_created_at))
-                    conn.commit()
-                    queue.task_done()
-                except Exception as e:
-                    logger.error(f"Error in stream.message_recorder: {e}")
-                    conn.rollback()
+
+    # The time the post is recorded is set by the database when the insert 
+    # runs, in UTC without a time zone like the other stage timestamps
+    sql = """
+        INSERT INTO posts (
+            post_uri, 
+            post_text,
+            post_created_at,
+            received_at,
+            recorded_at) 
+        VALUES (%s, %s, %s, %s, clock_timestamp() AT TIME ZONE 'UTC');
+        """
+    while True:
+        post = await queue.get()
+        try:
+            params = (
+                post["uri"], 
+                post["text"], 
+                post["created_at"], 
+                post["received_at"])
+            await db.execute(sql, params)
+        except Exception as e:
+            logger.error(f"Error in stream.message_recorder: {e}")
+        finally:
+            queue.task_done()
+
+# Delete posts ---------------------------------------------------------------
+
+async def delete_posts(post_uris: list) -> list:
+
+    # Mark uncatalogued, in progress and complete posts as deleted, delete 
+    # the images of complete posts, and return the image filepaths. The 
+    # processor does not save results for posts deleted while in progress
+    sql = """
+        WITH deleted_posts AS (
+            UPDATE posts 
+            SET 
+                post_status_id = (%s),
+                updated_at = now()
+            WHERE 
+                post_uri = ANY(%s) AND 
+                post_status_id IN (%s, %s, %s)
+            RETURNING post_id)
+        DELETE FROM images 
+        WHERE post_id IN (SELECT post_id FROM deleted_posts)
+        RETURNING image_filepath;
+        """
+
+    params = (
+        db.POST_STATUS_DELETED, 
+        post_uris, 
+        db.POST_STATUS_UNCATALOGUED, 
+        db.POST_STATUS_IN_PROGRESS,
+        db.POST_STATUS_COMPLETE)
+
+    rows = await db.fetch_all(sql, params)
+    return [row["image_filepath"] for row in rows]
+
+# Delete files ---------------------------------------------------------------
+
+def delete_files(filepaths: list) -> None:
+    # Carry on with the remaining files if one cannot be removed, as their 
+    # rows have already been deleted
+    for filepath in filepaths:
+        try:
+            os.remove(filepath)
+        except OSError as e:
+            logger.error(f"Error in stream.delete_files: {e}")
+
+# Delete recorder ------------------------------------------------------------
+
+async def delete_recorder(
+        delete_queue: asyncio.Queue,
+        batch_size: int = 1000,
+        batch_interval: float = 5) -> None:
+
+    loop = asyncio.get_running_loop()
+
+    while True:
+
+        # Wait for the first delete then collect any that arrive within the 
+        # batch interval until the batch is full
+        post_uris = [await delete_queue.get()]
+        deadline = loop.time() + batch_interval
+
+        while len(post_uris) < batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                post_uri = await asyncio.wait_for(delete_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            post_uris.append(post_uri)
+
+        # Apply the batch and delete image files in a worker thread
+        try:
+            filepaths = await delete_posts(post_uris)
+            await asyncio.to_thread(delete_files, filepaths)
+        except Exception as e:
+            logger.error(f"Error in stream.delete_recorder: {e}")
+        finally:
+            for _ in post_uris:
+                delete_queue.task_done()
 
 # Stream from firehose -------------------------------------------------------
 
 async def stream(
         lifecycle: int = 10,
-        logfile: str = os.path.join("logs", "stream.log")) -> None:
+        report_interval: int = 300,
+        logfile: str = get_log_path("stream.log")) -> None:
 
     # Create logger
     logging.basicConfig(
@@ -146,34 +216,69 @@ async def stream(
     logger.info("Stream starting")
 
     # Create signal monitor
-    signal_monitor = SignalMonitor("Stream", logger)
+    signal_monitor = SignalMonitor(
+        "Stream", 
+        logger, 
+        os.path.dirname(logfile))
 
-    # Create client
-    client = AsyncFirehoseSubscribeReposClient()
+    # Open database connection pool
+    await db.open_pool(max_size=2)
 
-    # Create queue
+    # Create client, using the Bluesky firehose unless another is set
+    client = AsyncFirehoseSubscribeReposClient(
+        base_uri=os.getenv("SF_FIREHOSE_URI"))
+
+    # Create queues
     queue = asyncio.Queue()
+    delete_queue = asyncio.Queue()
+
+    # Compile filter rules
+    filter_engine = FilterEngine(load_rules())
 
     # Create message handler
-    message_handler = get_message_handler(queue)
+    message_handler = get_message_handler(
+        queue, 
+        delete_queue, 
+        filter_engine)
     handler_task = asyncio.create_task(client.start(message_handler))
 
     # Create message recorder
     recorder_task = asyncio.create_task(message_recorder(queue))
+
+    # Create delete recorder
+    delete_recorder_task = asyncio.create_task(delete_recorder(delete_queue))
+
+    # Report queue depths when state is dumped
+    signal_monitor.add_probe("Queue depth", queue.qsize)
+    signal_monitor.add_probe("Delete queue depth", delete_queue.qsize)
     
     # Report running
     print("Stream running")
     logger.info("Stream running")
 
+    # Set next filter report
+    next_report = datetime.now().timestamp() + report_interval
+
     # Run for lifecycle seconds
     while not signal_monitor.shutdown:
         await asyncio.sleep(lifecycle)
 
+        # Report filter rule counts periodically
+        if datetime.now().timestamp() >= next_report:
+            filter_engine.report(logger)
+            next_report = datetime.now().timestamp() + report_interval
+
     # Shut down tasks when complete
     await client.stop()
     await handler_task
     await queue.join()
+    await delete_queue.join()
     recorder_task.cancel()
+    delete_recorder_task.cancel()
+    await db.close_pool()
+
+    # Report final filter rule counts
+    filter_engine.report(logger)
 
 # Main -----------------------------------------------------------------------
     
@@ -2,28 +2,248 @@
 
 # Imports --------------------------------------------------------------------
 
+import asyncio
+import io
+import logging
+import os
 import re
 import signal
+import sys
+import threading
+import time
 
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from datetime import timezone
 from types import FrameType
+from typing import Any
+from typing import Callable
+from typing import Iterator
+
+# Sampling profiler class ----------------------------------------------------
+
+class SamplingProfiler:
+
+    """
+    Samples the stacks of all other threads at a fixed interval and counts 
+    them in the collapsed stack format read by flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval: float = 0.01) -> None:
+        self.interval = interval
+        self.counts = Counter()
+        self.running = False
+        self.thread = None
+
+    def start(self) -> None:
+        self.counts.clear()
+        self.running = True
+        self.thread = threading.Thread(
+            target=self.run, 
+            name="SamplingProfiler",
+            daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self) -> None:
+        profiler_id = threading.get_ident()
+        while self.running:
+            thread_names = {
+                thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == profiler_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(
+                        f"{code.co_name} "
+                        f"({code.co_filename}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(thread_names.get(thread_id, str(thread_id)))
+                self.counts[";".join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def write(self, filepath: str) -> None:
+        with open(filepath, "w") as f:
+            for stack, count in self.counts.items():
+                f.write(f"{stack} {count}\n")
 
 # Signal monitor class -------------------------------------------------------
     
 class SignalMonitor:
+
+    """
+    Shuts down on SIGINT and SIGTERM. On SIGUSR1 starts a sampling profile, 
+    or stops it and writes it to the log directory. On SIGUSR2 logs the 
+    stacks of all asyncio tasks and the values of any registered probes.
+    """
     
     shutdown = False
   
-    def __init__(self, name, logger) -> None:
+    def __init__(
+            self, 
+            name, 
+            logger, 
+            log_dir: str = "logs") -> None:
         self.name = name
         self.logger = logger
+        self.log_dir = log_dir
+        self.profiler = None
+        self.probes = {}
         signal.signal(signal.SIGINT, self.exit)
         signal.signal(signal.SIGTERM, self.exit)
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, self.toggle_profiler)
+            signal.signal(signal.SIGUSR2, self.dump_state)
 
     def exit(self, signum: int, frame: FrameType | None) -> None:
         print(f"{self.name} shutting down")
         self.logger.info(f"{self.name} shutting down")
         self.shutdown = True
 
+    def add_probe(self, name: str, probe: Callable[[], Any]) -> None:
+        self.probes[name] = probe
+
+    def toggle_profiler(self, signum: int, frame: FrameType | None) -> None:
+
+        # Start profiling if not already profiling
+        if self.profiler is None:
+            self.profiler = SamplingProfiler()
+            self.profiler.start()
+            self.logger.info(f"{self.name} profiler started")
+            return
+
+        # Otherwise stop profiling and write the profile
+        self.profiler.stop()
+        timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        filename = f"{self.name.lower().replace(' ', '-')}-{timestamp}.folded"
+        filepath = os.path.join(self.log_dir, filename)
+        try:
+            self.profiler.write(filepath)
+            self.logger.info(f"{self.name} profile written to {filepath}")
+        except Exception as e:
+            self.logger.error(f"Error in utils.toggle_profiler: {e}")
+        self.profiler = None
+
+    def dump_state(self, signum: int, frame: FrameType | None) -> None:
+
+        buffer = io.StringIO()
+
+        # Dump the stack of each asyncio task
+        try:
+            tasks = asyncio.all_tasks(asyncio.get_running_loop())
+            buffer.write(f"{len(tasks)} asyncio tasks\n")
+            for task in tasks:
+                task.print_stack(file=buffer)
+        except RuntimeError:
+            buffer.write("No running event loop\n")
+
+        # Dump the value of each probe
+        for name, probe in self.probes.items():
+            try:
+                buffer.write(f"{name}: {probe()}\n")
+            except Exception as e:
+                buffer.write(f"{name}: error {e}\n")
+
+        self.logger.info(f"{self.name} state\n{buffer.getvalue()}")
+
+# Startup timer class -------------------------------------------------------
+
+class StartupTimer:
+
+    """ 
+    Times named startup phases, which may overlap, relative to the time the 
+    timer was created.
+    """
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        phase_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            phase_end = time.perf_counter()
+            self.phases[name] = (
+                phase_start - self.start, 
+                phase_end - phase_start)
+
+    def report(self, name: str, logger: logging.Logger) -> None:
+        for phase, (offset, duration) in self.phases.items():
+            logger.info(
+                f"{name} startup phase {phase}: "
+                f"started at {offset:.3f}s, took {duration:.3f}s")
+        total = time.perf_counter() - self.start
+        logger.info(f"{name} ready after {total:.3f}s")
+
+# Throughput counter class ---------------------------------------------------
+
+class ThroughputCounter:
+
+    """
+    Counts the items handled by a repeated step and the time spent in it, and
+    reports the rate at which the step handled them since the last report.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.reset()
+
+    def reset(self) -> None:
+        self.steps = 0
+        self.seconds = 0.0
+        self.counts = {}
+
+    def add(self, seconds: float, **counts: int) -> None:
+        self.steps += 1
+        self.seconds += seconds
+        for key, count in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + count
+
+    def get_counts(self) -> dict:
+        return {"steps": self.steps, "seconds": self.seconds, **self.counts}
+
+    def report(self, logger: logging.Logger) -> None:
+        rates = ", ".join(
+            f"{count} {key} ({count / self.seconds:.1f}/s)"
+            for key, count in self.counts.items() if self.seconds > 0)
+        logger.info(
+            f"{self.name}: {self.steps} steps in {self.seconds:.3f}s"
+            f"{', ' + rates if rates else ''}")
+        self.reset()
+
+# Log file path --------------------------------------------------------------
+
+def get_log_path(filename: str) -> str:
+
+    """ 
+    Get the path of a log file in the log directory, which is logs unless 
+    SF_LOG_DIR is set. 
+    """
+
+    return os.path.join(os.getenv("SF_LOG_DIR", "logs"), filename)
+
+# Current UTC time -----------------------------------------------------------
+
+def utc_now() -> datetime:
+
+    """ 
+    Get the current time in UTC without a timezone, which is how timestamps 
+    from post records are stored in the database. 
+    """
+
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
 # Squish string --------------------------------------------------------------
 
 def str_squish(s: str) -> str: